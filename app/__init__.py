@@ -8,8 +8,9 @@ from pathlib import Path
 # Add parent directory to path to import config
 sys.path.insert(0, str(Path(__file__).parent.parent))
 from config import Config
+from app.database import RoutingSession, apply_sqlite_pragmas, create_read_engine
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 login_manager = LoginManager()
 
 def create_app(config_class=Config):
@@ -19,10 +20,27 @@ def create_app(config_class=Config):
     # Initialize extensions
     db.init_app(app)
     login_manager.init_app(app)
+    
+    # Tune SQLite connections and set up the engine for read-only views
+    with app.app_context():
+        apply_sqlite_pragmas(db.engine, app.config.get('SQLITE_PRAGMAS'))
+        read_engine = create_read_engine(app, db.engine)
+        if read_engine is not None:
+            app.extensions['read_engine'] = read_engine
     login_manager.login_view = 'login'
     login_manager.login_message = 'Please log in to access this page.'
     login_manager.login_message_category = 'info'
     
+    # Size the shared term vector cache used by the matcher
+    from app.bati.scoring import term_vector_cache
+    term_vector_cache.maxsize = app.config.get('TERM_VECTOR_CACHE_SIZE', 10000)
+    
+    # Size and empty the cache of logged-in users; a TTL of 0 disables it
+    from app.models import user_cache
+    user_cache.maxsize = app.config.get('USER_CACHE_SIZE', 1024)
+    user_cache.ttl = app.config.get('USER_CACHE_TTL', 60)
+    user_cache.clear()
+    
     # Create upload directory if it doesn't exist
     upload_folder = app.config['UPLOAD_FOLDER']
     os.makedirs(upload_folder, exist_ok=True)
@@ -32,12 +50,40 @@ def create_app(config_class=Config):
     def inject_config():
         return dict(config=app.config)
     
+    # Hash passwords on a bounded pool so login bursts queue
+    from app.passwords import init_passwords
+    init_passwords(app)
+    
+    # Resize uploaded images in the background
+    from app.uploads import init_uploads, upload_url
+    init_uploads(app)
+    app.jinja_env.globals['upload_url'] = upload_url
+    
     # Register blueprints
     from app.routes import bp as routes_bp
     app.register_blueprint(routes_bp)
     
     # Create database tables
     with app.app_context():
+        from app.schema import upgrade_schema
         db.create_all()
+        upgrade_schema()
+    
+    # Record request timings and metrics when INSTRUMENTATION_ENABLED is set
+    from app.instrumentation import init_instrumentation
+    with app.app_context():
+        init_instrumentation(app, [db.engine, app.extensions.get('read_engine')])
+    
+    # Push match events to the open streams of the users concerned
+    from app.events import init_events
+    init_events(app)
+    
+    # Start background matching and resume jobs queued before a restart
+    from app.jobs import init_match_queue
+    init_match_queue(app)
+    
+    # Register CLI commands
+    from app.commands import register_commands
+    register_commands(app)
     
     return app
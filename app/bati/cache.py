@@ -0,0 +1,70 @@
+"""
+In-process caches.
+"""
+from collections import OrderedDict
+import threading
+import time
+
+class LRUCache:
+    """Thread-safe mapping that evicts the least recently used entry when full"""
+    
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key, default=None):
+        """Return the value for key and mark it as recently used"""
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+    
+    def set(self, key, value):
+        """Store a value, evicting the oldest entries if the cache is full"""
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+    
+    def pop(self, key, default=None):
+        """Remove a key and return its value"""
+        with self._lock:
+            return self._data.pop(key, default)
+    
+    def clear(self):
+        """Remove all entries"""
+        with self._lock:
+            self._data.clear()
+    
+    def __len__(self):
+        return len(self._data)
+
+class TTLCache(LRUCache):
+    """LRU cache whose entries expire ``ttl`` seconds after they are set"""
+    
+    def __init__(self, maxsize=1024, ttl=60):
+        super().__init__(maxsize)
+        self.ttl = ttl
+    
+    def get(self, key, default=None):
+        """Return the value for key unless it has expired"""
+        entry = super().get(key)
+        if entry is None:
+            return default
+        expires_at, value = entry
+        if time.monotonic() >= expires_at:
+            self.pop(key)
+            return default
+        return value
+    
+    def set(self, key, value):
+        """Store a value that expires after ttl seconds"""
+        super().set(key, (time.monotonic() + self.ttl, value))
+    
+    def pop(self, key, default=None):
+        """Remove a key and return its value, expired or not"""
+        entry = super().pop(key)
+        return default if entry is None else entry[1]
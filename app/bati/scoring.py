@@ -0,0 +1,453 @@
+"""
+Vectorized match scoring.
+Scores one item against a batch of candidates, or two batches against
+each other, with NumPy arrays instead of a Python loop per pair.
+Distances are chord lengths between positions on the unit sphere, which
+items store when they are saved. Scores agree with the per-pair functions
+in utils to float tolerance.
+"""
+from collections import Counter, namedtuple
+from datetime import datetime
+import heapq
+import math
+import numpy as np
+from app.bati.cache import LRUCache
+from app.bati.utils import tokenize, calculate_unit_vector
+
+# Earth radius in meters
+EARTH_RADIUS = 6371000
+
+# Weights of the match score components
+TEXT_WEIGHT = 0.5
+LOCATION_WEIGHT = 0.3
+TIME_WEIGHT = 0.2
+
+# Reports further apart than this get a time score of 0
+MAX_TIME_DIFFERENCE = 7 * 24 * 3600  # 7 days in seconds
+
+_EPOCH = datetime(1970, 1, 1)
+
+# Term frequencies of a document and their euclidean norm
+TermVector = namedtuple('TermVector', ['counts', 'norm'])
+
+# Plain item fields needed for scoring, cheap to send to worker processes;
+# the unit sphere position is computed from the coordinates when missing
+ItemRecord = namedtuple('ItemRecord', ['id', 'title', 'description', 'latitude', 'longitude',
+                                       'reported_at', 'unit_x', 'unit_y', 'unit_z'],
+                        defaults=(None, None, None))
+
+def item_position(item):
+    """Stored unit sphere position of an item, or one computed from its coordinates"""
+    if item.unit_x is not None:
+        return (item.unit_x, item.unit_y, item.unit_z)
+    return calculate_unit_vector(item.latitude, item.longitude)
+
+def match_time_window(threshold):
+    """
+    Widest report time difference at which a pair can still reach a score.
+    
+    Text and location scores are at most 1 and the time score falls
+    linearly to 0 over MAX_TIME_DIFFERENCE, so pairs reported further
+    apart than this score below the threshold whatever their text and
+    location.
+    
+    Args:
+        threshold: Lowest score of interest
+    
+    Returns:
+        float: Window in seconds, or None if text and location alone can reach the threshold
+    """
+    if threshold <= TEXT_WEIGHT + LOCATION_WEIGHT:
+        return None
+    slack = TEXT_WEIGHT + LOCATION_WEIGHT + TIME_WEIGHT - threshold
+    return max(slack, 0.0) / TIME_WEIGHT * MAX_TIME_DIFFERENCE
+
+def item_text(item):
+    """Text of an item used for similarity scoring"""
+    return f"{item.title} {item.description or ''}"
+
+def term_vector(text):
+    """
+    Tokenize text into a term-frequency vector.
+    
+    Args:
+        text: Text string
+    
+    Returns:
+        TermVector: Term counts and their norm
+    """
+    counts = Counter(tokenize(text))
+    return TermVector(counts, math.sqrt(sum(count * count for count in counts.values())))
+
+class IdfWeights:
+    """
+    Smoothed inverse document frequency weights for a corpus.
+    
+    Terms that occur in many items (e.g. "black", "phone") weigh less than
+    rare ones, so shared rare words dominate the text similarity.
+    """
+    
+    def __init__(self, document_frequencies, document_count):
+        """
+        Args:
+            document_frequencies: Mapping of term to the number of items containing it
+            document_count: Number of items in the corpus
+        """
+        self.document_frequencies = document_frequencies
+        self.document_count = document_count
+    
+    def weight(self, term):
+        """IDF weight of a term; terms missing from the corpus get the highest weight"""
+        document_frequency = self.document_frequencies.get(term, 0)
+        return math.log((1 + self.document_count) / (1 + document_frequency)) + 1
+    
+    def apply(self, vector):
+        """
+        Weight a term vector by IDF.
+        
+        Returns:
+            TermVector: TF-IDF weights and their norm
+        """
+        counts = {term: count * self.weight(term) for term, count in vector.counts.items()}
+        return TermVector(counts, math.sqrt(sum(value * value for value in counts.values())))
+
+def cosine_similarity(vector1, vector2, idf=None):
+    """
+    Cosine similarity of two term vectors.
+    
+    Args:
+        vector1, vector2: TermVector instances
+        idf: Optional IdfWeights applied to both vectors
+    
+    Returns:
+        float: Similarity between 0 and 1
+    """
+    if idf is not None:
+        vector1 = idf.apply(vector1)
+        vector2 = idf.apply(vector2)
+    if vector1.norm == 0 or vector2.norm == 0:
+        return 0.0
+    if len(vector1.counts) > len(vector2.counts):
+        vector1, vector2 = vector2, vector1
+    dot_product = sum(count * vector2.counts.get(term, 0) for term, count in vector1.counts.items())
+    return dot_product / (vector1.norm * vector2.norm)
+
+class TermVectorCache:
+    """
+    Bounded cache of item term vectors, keyed by item id.
+    
+    Entries remember the reported_at and text they were built from, so an
+    edited item is re-tokenized on its next lookup instead of being served
+    a stale vector.
+    """
+    
+    def __init__(self, maxsize=10000):
+        self._cache = LRUCache(maxsize)
+    
+    @property
+    def maxsize(self):
+        return self._cache.maxsize
+    
+    @maxsize.setter
+    def maxsize(self, value):
+        self._cache.maxsize = value
+    
+    def get(self, item):
+        """
+        Return the term vector of an item, tokenizing it on a miss.
+        
+        Args:
+            item: Item instance
+        
+        Returns:
+            TermVector: Term counts and their norm
+        """
+        text = item_text(item)
+        version = (item.reported_at, text)
+        if item.id is not None:
+            entry = self._cache.get(item.id)
+            if entry is not None and entry[0] == version:
+                return entry[1]
+        vector = term_vector(text)
+        if item.id is not None:
+            self._cache.set(item.id, (version, vector))
+        return vector
+    
+    def discard(self, item_id):
+        """Forget the cached vector of an item"""
+        self._cache.pop(item_id)
+    
+    def clear(self):
+        """Forget all cached vectors"""
+        self._cache.clear()
+
+# Shared by the matcher and the Item model events that keep it warm
+term_vector_cache = TermVectorCache()
+
+class TermMatrix:
+    """
+    Sparse term-frequency matrix for a batch of documents.
+    
+    Stored column-major (one posting list per term) so that the dot
+    products of a query vector with every document only touch the
+    postings of the query's terms.
+    """
+    
+    def __init__(self, vectors, idf=None):
+        """
+        Args:
+            vectors: List of TermVector, one per document
+            idf: Optional IdfWeights applied to every document and query
+        """
+        self.size = len(vectors)
+        self.idf = idf
+        postings = {}
+        for row, vector in enumerate(vectors):
+            for term, count in vector.counts.items():
+                postings.setdefault(term, []).append((row, count))
+        
+        self.columns = {}
+        for term, entries in postings.items():
+            rows, counts = zip(*entries)
+            weights = np.array(counts, dtype=float)
+            if idf is not None:
+                weights *= idf.weight(term)
+            self.columns[term] = (np.array(rows, dtype=np.intp), weights)
+        
+        if idf is None:
+            self.norms = np.array([vector.norm for vector in vectors], dtype=float)
+        elif self.columns:
+            rows, weights = zip(*self.columns.values())
+            weights = np.concatenate(weights)
+            self.norms = np.sqrt(np.bincount(np.concatenate(rows), weights=weights * weights,
+                                             minlength=self.size))
+        else:
+            self.norms = np.zeros(self.size)
+    
+    def dot(self, vector):
+        """
+        Dot product of a TermVector with every document.
+        
+        Returns:
+            ndarray: One value per document
+        """
+        rows = []
+        weights = []
+        for term, count in vector.counts.items():
+            column = self.columns.get(term)
+            if column is not None:
+                rows.append(column[0])
+                weights.append(column[1] * count)
+        if not rows:
+            return np.zeros(self.size)
+        return np.bincount(np.concatenate(rows), weights=np.concatenate(weights),
+                           minlength=self.size)
+    
+    def cosine(self, vector):
+        """
+        Cosine similarity of a TermVector with every document.
+        The vector is IDF-weighted the same way as the documents.
+        
+        Returns:
+            ndarray: Similarities between 0 and 1, 0 for empty documents
+        """
+        if self.idf is not None:
+            vector = self.idf.apply(vector)
+        if vector.norm == 0:
+            return np.zeros(self.size)
+        denominator = self.norms * vector.norm
+        similarity = np.zeros(self.size)
+        np.divide(self.dot(vector), denominator, out=similarity, where=denominator > 0)
+        return similarity
+
+class ItemBatch:
+    """Positions, timestamps and term vectors of a batch of items as arrays"""
+    
+    def __init__(self, items, idf=None):
+        self.ids = np.array([item.id for item in items], dtype=np.int64)
+        self.positions = _positions(items)
+        self.timestamps = np.array([(item.reported_at - _EPOCH).total_seconds() for item in items],
+                                   dtype=float)
+        self.vectors = [term_vector_cache.get(item) for item in items]
+        self.terms = TermMatrix(self.vectors, idf)
+    
+    def __len__(self):
+        return len(self.ids)
+
+def _positions(items):
+    """Unit sphere positions of items as an array with one row per item"""
+    return np.array([item_position(item) for item in items], dtype=float).reshape(-1, 3)
+
+def chord_distances(position, positions):
+    """
+    Distances from one point to many by the chord between their unit sphere
+    positions; see calculate_chord_distance for the error bound.
+    
+    Returns:
+        ndarray: Distances in meters
+    """
+    differences = positions - position
+    return EARTH_RADIUS * np.sqrt(np.einsum('ij,ij->i', differences, differences))
+
+def haversine_distances(lat, lon, latitudes, longitudes):
+    """
+    Great circle distances from one point to many, all in radians.
+    
+    Returns:
+        ndarray: Distances in meters
+    """
+    a = (np.sin((latitudes - lat) / 2) ** 2 +
+         np.cos(lat) * np.cos(latitudes) * np.sin((longitudes - lon) / 2) ** 2)
+    return EARTH_RADIUS * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+def _score_row(batch, index, candidates, proximity_threshold):
+    """Score item ``index`` of ``batch`` against every item of ``candidates``"""
+    text_scores = candidates.terms.cosine(batch.vectors[index])
+    
+    distances = chord_distances(batch.positions[index], candidates.positions)
+    location_scores = np.maximum(0, 1 - distances / proximity_threshold)
+    
+    time_diffs = np.abs(candidates.timestamps - batch.timestamps[index])
+    time_scores = np.maximum(0, 1 - time_diffs / MAX_TIME_DIFFERENCE)
+    
+    return (TEXT_WEIGHT * text_scores + LOCATION_WEIGHT * location_scores +
+            TIME_WEIGHT * time_scores)
+
+def score_candidates(item, candidates, proximity_threshold, idf=None):
+    """
+    Calculate match scores between one item and a batch of candidates.
+    
+    Args:
+        item: Item instance
+        candidates: List of Item instances or an ItemBatch
+        proximity_threshold: Distance in meters at which the location score reaches 0
+        idf: Optional IdfWeights for the text score, used when candidates is a list
+    
+    Returns:
+        ndarray: Score between 0 and 1 for each candidate
+    """
+    if not isinstance(candidates, ItemBatch):
+        candidates = ItemBatch(candidates, idf)
+    if not len(candidates):
+        return np.zeros(0)
+    return _score_row(ItemBatch([item]), 0, candidates, proximity_threshold)
+
+def top_k_candidates(item, candidates, k, proximity_threshold, idf=None, min_score=0.0):
+    """
+    Find the k best scoring candidates of an item without scoring them all.
+    
+    Location and time scores are computed for every candidate in one
+    vectorized pass. The text score adds at most TEXT_WEIGHT, so candidates
+    are text-scored in blocks in order of that upper bound while a heap
+    keeps the k best so far, and the search stops as soon as no remaining
+    candidate could beat the k-th best score. Blocks start small and double
+    in size, so a clear winner is found after a few candidates while a
+    flat field costs little more than scoring everything at once.
+    
+    Args:
+        item: Item instance
+        candidates: List of Item instances
+        k: Number of candidates to return
+        proximity_threshold: Distance in meters at which the location score reaches 0
+        idf: Optional IdfWeights for the text score
+        min_score: Candidates scoring below this are left out
+    
+    Returns:
+        list: Up to k (score, candidate) tuples, best first, ties by id
+    """
+    if not candidates or k <= 0:
+        return []
+    batch = ItemBatch([item])
+    timestamps = np.array([(candidate.reported_at - _EPOCH).total_seconds()
+                           for candidate in candidates], dtype=float)
+    
+    distances = chord_distances(batch.positions[0], _positions(candidates))
+    location_scores = np.maximum(0, 1 - distances / proximity_threshold)
+    time_scores = np.maximum(0, 1 - np.abs(timestamps - batch.timestamps[0]) / MAX_TIME_DIFFERENCE)
+    partial_scores = LOCATION_WEIGHT * location_scores + TIME_WEIGHT * time_scores
+    order = np.argsort(-partial_scores, kind='stable')
+    
+    best = []  # min-heap of (score, -id, index) so the worst kept candidate is first
+    start, block_size = 0, max(4 * k, 32)
+    while start < len(order):
+        # Candidates are visited by decreasing bound, so none of the rest can do better
+        bound = partial_scores[order[start]] + TEXT_WEIGHT
+        if bound < min_score or (len(best) == k and bound < best[0][0]):
+            break
+        indices = order[start:start + block_size]
+        text_scores = TermMatrix([term_vector_cache.get(candidates[index]) for index in indices],
+                                 idf).cosine(batch.vectors[0])
+        scores = partial_scores[indices] + TEXT_WEIGHT * text_scores
+        for index, score in zip(indices.tolist(), scores.tolist()):
+            if score < min_score:
+                continue
+            entry = (score, -candidates[index].id, index)
+            if len(best) < k:
+                heapq.heappush(best, entry)
+            elif entry > best[0]:
+                heapq.heapreplace(best, entry)
+        start += block_size
+        block_size *= 2
+    
+    return [(score, candidates[index]) for score, _, index in sorted(best, reverse=True)]
+
+def score_batches(items, candidates, proximity_threshold, idf=None):
+    """
+    Calculate match scores between every pair of two batches of items.
+    
+    Args:
+        items: List of Item instances or an ItemBatch
+        candidates: List of Item instances or an ItemBatch
+        proximity_threshold: Distance in meters at which the location score reaches 0
+        idf: Optional IdfWeights for the text score, used when candidates is a list
+    
+    Returns:
+        ndarray: Scores with one row per item and one column per candidate
+    """
+    if not isinstance(items, ItemBatch):
+        items = ItemBatch(items)
+    if not isinstance(candidates, ItemBatch):
+        candidates = ItemBatch(candidates, idf)
+    scores = np.zeros((len(items), len(candidates)))
+    if len(candidates):
+        for index in range(len(items)):
+            scores[index] = _score_row(items, index, candidates, proximity_threshold)
+    return scores
+
+# Candidate batch and settings of a scoring worker process
+_worker_state = {}
+
+def init_scoring_worker(candidates, idf, proximity_threshold, min_score):
+    """
+    Prepare a worker process to score chunks against a fixed candidate set.
+    Used as a ProcessPoolExecutor initializer so the candidates are sent
+    and indexed once per process rather than once per chunk.
+    
+    Args:
+        candidates: List of ItemRecord
+        idf: Optional IdfWeights for the text score
+        proximity_threshold: Distance in meters at which the location score reaches 0
+        min_score: Scores below this are not returned
+    """
+    _worker_state['candidates'] = ItemBatch(candidates, idf)
+    _worker_state['proximity_threshold'] = proximity_threshold
+    _worker_state['min_score'] = min_score
+
+def score_chunk(items):
+    """
+    Score a chunk of items against the worker's candidates.
+    
+    Args:
+        items: List of ItemRecord
+    
+    Returns:
+        tuple: (pairs, pair_count) where pairs lists (item id, candidate id, score)
+        for scores of at least min_score, and pair_count is the number of pairs scored
+    """
+    candidates = _worker_state['candidates']
+    scores = score_batches(items, candidates, _worker_state['proximity_threshold'])
+    pairs = [
+        (items[row].id, int(candidates.ids[col]), float(scores[row, col]))
+        for row, col in zip(*(scores >= _worker_state['min_score']).nonzero())
+    ]
+    return pairs, scores.size
@@ -33,6 +33,87 @@ def calculate_haversine_distance(lat1, lon1, lat2, lon2):
     distance = R * c
     return distance
 
+def calculate_unit_vector(lat, lon):
+    """
+    Position of a point on the unit sphere.
+    
+    Args:
+        lat, lon: Latitude and longitude in degrees
+    
+    Returns:
+        tuple: (x, y, z) Cartesian coordinates
+    """
+    phi = math.radians(lat)
+    lambda_ = math.radians(lon)
+    return (math.cos(phi) * math.cos(lambda_), math.cos(phi) * math.sin(lambda_), math.sin(phi))
+
+def calculate_chord_distance(vector1, vector2):
+    """
+    Distance between two points from their positions on the unit sphere.
+    
+    The straight chord between the points is shorter than the great circle
+    distance d by less than d**3 / (24 * R**2), about 0.1 mm at 5 km, and
+    needs no trigonometry once the positions are known.
+    
+    Args:
+        vector1, vector2: (x, y, z) tuples from calculate_unit_vector
+    
+    Returns:
+        float: Distance in meters
+    """
+    # Earth radius in meters
+    R = 6371000
+    return R * math.dist(vector1, vector2)
+
+def calculate_bounding_box(lat, lon, radius):
+    """
+    Calculate a latitude/longitude box enclosing a circle on Earth.
+    
+    Every point within ``radius`` meters of (lat, lon) by the haversine
+    distance lies inside the returned box, so it can be used to prune
+    candidates with an indexed range query before computing exact distances.
+    
+    Args:
+        lat, lon: Latitude and longitude of the center point
+        radius: Radius in meters
+    
+    Returns:
+        tuple: (min_lat, max_lat, min_lon, max_lon) in degrees
+    """
+    # Earth radius in meters
+    R = 6371000
+    
+    angular_radius = radius / R
+    delta_lat = math.degrees(angular_radius)
+    min_lat = lat - delta_lat
+    max_lat = lat + delta_lat
+    
+    # Near the poles or across the antimeridian the box spans all longitudes
+    if min_lat <= -90 or max_lat >= 90:
+        return max(min_lat, -90), min(max_lat, 90), -180, 180
+    
+    delta_lon = math.degrees(math.asin(math.sin(angular_radius) / math.cos(math.radians(lat))))
+    min_lon = lon - delta_lon
+    max_lon = lon + delta_lon
+    if min_lon < -180 or max_lon > 180:
+        return min_lat, max_lat, -180, 180
+    
+    return min_lat, max_lat, min_lon, max_lon
+
+def tokenize(text):
+    """
+    Normalize and tokenize text for similarity scoring.
+    
+    Args:
+        text: Text string to tokenize
+    
+    Returns:
+        list: Lowercased words with punctuation removed
+    """
+    text = text.lower()
+    text = re.sub(r'[^\w\s]', '', text)
+    return text.split()
+
 def calculate_text_similarity(text1, text2):
     """
     Calculate text similarity using TF-IDF-like approach.
@@ -47,12 +128,6 @@ def calculate_text_similarity(text1, text2):
     if not text1 or not text2:
         return 0.0
     
-    # Normalize and tokenize
-    def tokenize(text):
-        text = text.lower()
-        text = re.sub(r'[^\w\s]', '', text)
-        return text.split()
-    
     tokens1 = tokenize(text1)
     tokens2 = tokenize(text2)
     
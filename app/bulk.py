@@ -0,0 +1,234 @@
+"""
+Bulk import and export of items as CSV or JSON Lines.
+Files are streamed a row at a time. Imported rows are inserted in batches
+with executemany, bypassing the ORM, so the work the session events do
+for single reports (term index, dashboard counters, map version) is done
+here per batch, and matching is left to one bulk pass after the load.
+"""
+from datetime import datetime
+from types import SimpleNamespace
+import csv
+import json
+from sqlalchemy import func, select
+from app import db
+from app.models import Item, ItemTerm, Match, User, increment_counter
+from app.ingest import validate_report
+from app.bati.scoring import item_text, term_vector
+from app.bati.utils import calculate_unit_vector
+
+FORMATS = ('csv', 'jsonl')
+
+# Columns written by export_items and read back by import_items
+ITEM_COLUMNS = ('id', 'title', 'description', 'category', 'status', 'latitude', 'longitude',
+                'reported_at', 'is_verified', 'image_path', 'reporter')
+MATCH_COLUMNS = ('id', 'lost_item_id', 'found_item_id', 'confidence_score',
+                 'created_at', 'is_verified')
+
+class ImportResult:
+    """Counts of an item import"""
+    
+    def __init__(self):
+        self.imported = 0
+        self.skipped = 0
+    
+    def __str__(self):
+        return f'{self.imported} item(s) imported, {self.skipped} skipped'
+
+def guess_format(filename):
+    """File format from a file name extension, or None"""
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    return {'csv': 'csv', 'jsonl': 'jsonl', 'ndjson': 'jsonl'}.get(extension)
+
+def read_records(stream, fmt):
+    """
+    Iterate over the records of a CSV or JSON Lines stream.
+    
+    Empty CSV cells are read as missing values.
+    
+    Args:
+        stream: Text stream (CSV streams should be opened with newline='')
+        fmt: 'csv' or 'jsonl'
+    
+    Yields:
+        tuple: (line number, record mapping)
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, {key: value for key, value in record.items() if value != ''}
+    else:
+        for number, line in enumerate(stream, 1):
+            if line.strip():
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    record = None
+                yield number, record if isinstance(record, dict) else {}
+
+def _parse_bool(value):
+    """Boolean of a JSON value or CSV cell such as true/false or 1/0"""
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes')
+    return bool(value)
+
+def _insert_batch(rows, vectors):
+    """
+    Insert a batch of item rows with their term index entries and counters.
+    
+    The counters are updated first, which takes SQLite's write lock, so the
+    ids after the current largest one can be assigned here and sent with a
+    plain executemany instead of reading each generated id back.
+    
+    Args:
+        rows: Item column mappings, all with the same keys
+        vectors: TermVector of each row, in the same order
+    """
+    connection = db.session.connection()
+    increment_counter(connection, 'items_total', len(rows))
+    for status in ('lost', 'found'):
+        count = sum(1 for row in rows if row['status'] == status)
+        if count:
+            increment_counter(connection, f'items_{status}', count)
+    increment_counter(connection, 'map_version')
+    
+    table = Item.__table__
+    if connection.dialect.name == 'sqlite':
+        first_id = (connection.execute(select(func.max(table.c.id))).scalar() or 0) + 1
+        ids = range(first_id, first_id + len(rows))
+        connection.execute(table.insert(), [dict(row, id=item_id) for row, item_id in zip(rows, ids)])
+    else:
+        ids = connection.execute(
+            table.insert().returning(table.c.id, sort_by_parameter_order=True), rows
+        ).scalars().all()
+    
+    terms = [{'term': term, 'item_id': item_id, 'count': count}
+             for item_id, vector in zip(ids, vectors)
+             for term, count in vector.counts.items()]
+    if terms:
+        connection.execute(ItemTerm.__table__.insert(), terms)
+    db.session.commit()
+
+def import_items(records, reporter_id, batch_size=5000, on_error=None):
+    """
+    Validate and insert item records in batches.
+    
+    Records are validated like reports from the web forms. Invalid records
+    are skipped. A ``reporter`` email of an existing user is kept; other
+    items are attributed to reporter_id. Each batch is committed on its
+    own and no matching is done.
+    
+    Args:
+        records: Iterable of (line number, record mapping), see read_records
+        reporter_id: Id of the user reporting items without a known reporter
+        batch_size: Items inserted per executemany and commit
+        on_error: Optional callable receiving (line number, {field: message})
+    
+    Returns:
+        ImportResult: Numbers of imported and skipped records
+    """
+    result = ImportResult()
+    reporters = {}
+    rows, vectors = [], []
+    now = datetime.utcnow()
+    
+    for number, record in records:
+        # Images can't be uploaded from a file; image_path is copied instead
+        cleaned, errors = validate_report({key: value for key, value in record.items()
+                                           if key != 'image'})
+        if errors:
+            result.skipped += 1
+            if on_error:
+                on_error(number, errors)
+            continue
+        
+        email = record.get('reporter')
+        if email and email not in reporters:
+            reporters[email] = db.session.query(User.id).filter_by(email=email).scalar()
+        image_path = record.get('image_path')
+        unit_x, unit_y, unit_z = calculate_unit_vector(cleaned['latitude'], cleaned['longitude'])
+        rows.append({
+            'title': cleaned['title'],
+            'description': cleaned['description'],
+            'category': cleaned['category'],
+            'status': cleaned['status'],
+            'latitude': cleaned['latitude'],
+            'longitude': cleaned['longitude'],
+            'unit_x': unit_x,
+            'unit_y': unit_y,
+            'unit_z': unit_z,
+            'image_path': image_path if isinstance(image_path, str) and image_path else None,
+            'reported_by': reporters.get(email) or reporter_id,
+            'reported_at': cleaned['reported_at'] or now,
+            'is_verified': _parse_bool(record.get('is_verified', False))
+        })
+        vectors.append(term_vector(item_text(SimpleNamespace(**cleaned))))
+        if len(rows) >= batch_size:
+            _insert_batch(rows, vectors)
+            result.imported += len(rows)
+            rows, vectors = [], []
+    
+    if rows:
+        _insert_batch(rows, vectors)
+        result.imported += len(rows)
+    return result
+
+def _item_rows(batch_size):
+    """Stream all items with their reporter's email, in id order"""
+    query = db.session.query(Item.id, Item.title, Item.description, Item.category, Item.status,
+                             Item.latitude, Item.longitude, Item.reported_at, Item.is_verified,
+                             Item.image_path, User.email) \
+        .join(User, Item.reported_by == User.id).order_by(Item.id)
+    return query.yield_per(batch_size)
+
+def _match_rows(batch_size):
+    """Stream all matches in id order"""
+    query = db.session.query(Match.id, Match.lost_item_id, Match.found_item_id,
+                             Match.confidence_score, Match.created_at,
+                             Match.is_verified).order_by(Match.id)
+    return query.yield_per(batch_size)
+
+def _serialize(value, fmt):
+    """Column value as written to a file"""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if fmt == 'csv':
+        if isinstance(value, bool):
+            return 'true' if value else 'false'
+        if value is None:
+            return ''
+    return value
+
+def write_records(rows, columns, stream, fmt):
+    """
+    Write rows to a CSV or JSON Lines stream.
+    
+    Args:
+        rows: Iterable of tuples with one value per column
+        columns: Column names
+        stream: Text stream (CSV streams should be opened with newline='')
+        fmt: 'csv' or 'jsonl'
+    
+    Returns:
+        int: Number of rows written
+    """
+    count = 0
+    if fmt == 'csv':
+        writer = csv.writer(stream)
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow([_serialize(value, fmt) for value in row])
+            count += 1
+    else:
+        for row in rows:
+            record = {column: _serialize(value, fmt) for column, value in zip(columns, row)}
+            stream.write(json.dumps(record) + '\n')
+            count += 1
+    return count
+
+def export_items(stream, fmt, batch_size=1000):
+    """Write all items to a stream, fetching batch_size rows at a time; returns the count"""
+    return write_records(_item_rows(batch_size), ITEM_COLUMNS, stream, fmt)
+
+def export_matches(stream, fmt, batch_size=1000):
+    """Write all matches to a stream, fetching batch_size rows at a time; returns the count"""
+    return write_records(_match_rows(batch_size), MATCH_COLUMNS, stream, fmt)
@@ -0,0 +1,128 @@
+"""
+Flask CLI commands for maintenance tasks.
+Run with ``flask --app run <command>``.
+"""
+from contextlib import nullcontext
+import click
+from app import db
+from app.models import User
+from app.matching import find_all_matches, rematch_dirty_items, archive_items
+from app.bulk import FORMATS, guess_format, read_records, import_items, export_items, export_matches
+from app.stats import refresh_site_stats
+from app.queryplan import explain_hot_queries
+
+def _resolve_format(path, fmt):
+    """File format from the --format option or the file name"""
+    fmt = fmt or (guess_format(path) if path != '-' else None)
+    if fmt is None:
+        raise click.UsageError('Cannot tell the file format; use --format csv or --format jsonl.')
+    return fmt
+
+def _text_stream(path, mode):
+    """Open a file, or stdin/stdout for '-', for the csv and json modules"""
+    if path == '-':
+        return nullcontext(click.get_text_stream('stdin' if mode == 'r' else 'stdout'))
+    return open(path, mode, newline='', encoding='utf-8')
+
+def register_commands(app):
+    """Register the CLI commands of the app"""
+    
+    @app.cli.command('recompute-matches')
+    @click.option('--workers', type=int, default=None,
+                  help='Worker processes (default: MATCHING_RECOMPUTE_WORKERS or CPU count).')
+    @click.option('--chunk-size', type=int, default=None,
+                  help='Lost items scored per chunk (default: MATCHING_RECOMPUTE_CHUNK_SIZE).')
+    def recompute_matches(workers, chunk_size):
+        """Rescore every lost/found pair and save matches above the threshold."""
+        def report(progress):
+            click.echo(f'\r{progress}', nl=False)
+        
+        result = find_all_matches(workers=workers, chunk_size=chunk_size, progress=report)
+        click.echo(f'\rDone in {result.elapsed:.1f}s: {result}')
+    
+    @app.cli.command('rematch-dirty')
+    @click.option('--limit', type=int, default=None, help='Maximum number of items to process.')
+    def rematch_dirty(limit):
+        """Rescore matches of items edited since they were last matched."""
+        count = rematch_dirty_items(limit=limit)
+        click.echo(f'Rematched {count} edited item(s).')
+    
+    @app.cli.command('archive-items')
+    def archive_items_command():
+        """Archive the items of verified matches and drop their other suggested matches."""
+        count = archive_items()
+        db.session.commit()
+        click.echo(f'Archived {count} item(s).')
+    
+    @app.cli.command('refresh-stats')
+    def refresh_stats():
+        """Recount the homepage statistics from the database."""
+        stats = refresh_site_stats()
+        click.echo(', '.join(f'{name}={value}' for name, value in stats.items()))
+    
+    @app.cli.command('explain-queries')
+    @click.option('--verbose', is_flag=True, help='Print the SQL of every statement.')
+    def explain_queries(verbose):
+        """Check the query plans of the hot queries for table scans and sorts."""
+        plans = explain_hot_queries()
+        for plan in plans:
+            status = click.style('WARN', fg='yellow') if plan.warnings else click.style('OK', fg='green')
+            click.echo(f'[{status}] {plan.name}' + (f': {", ".join(plan.warnings)}' if plan.warnings else ''))
+            if verbose or plan.warnings:
+                if verbose:
+                    click.echo(f'    {" ".join(plan.statement.split())}')
+                for detail in plan.plan:
+                    click.echo(f'    {detail}')
+        
+        flagged = sum(1 for plan in plans if plan.warnings)
+        click.echo(f'{len(plans)} statement(s) explained, {flagged} flagged.')
+        if flagged:
+            raise SystemExit(1)
+    
+    @app.cli.command('import-items')
+    @click.argument('path', type=click.Path(allow_dash=True, dir_okay=False))
+    @click.option('--reporter', required=True,
+                  help='Email of the user reporting items without a known reporter column.')
+    @click.option('--format', 'fmt', type=click.Choice(FORMATS), default=None,
+                  help='File format (default: from the file extension).')
+    @click.option('--batch-size', type=int, default=None,
+                  help='Items inserted per batch (default: IMPORT_BATCH_SIZE).')
+    @click.option('--no-match', is_flag=True, help='Skip matching; run recompute-matches later.')
+    def import_items_command(path, reporter, fmt, batch_size, no_match):
+        """Import items from a CSV or JSON Lines file, then match them in one pass."""
+        fmt = _resolve_format(path, fmt)
+        reporter_id = User.query.with_entities(User.id).filter_by(email=reporter).scalar()
+        if reporter_id is None:
+            raise click.BadParameter(f'No user with email {reporter}.', param_hint='--reporter')
+        if batch_size is None:
+            batch_size = app.config.get('IMPORT_BATCH_SIZE', 5000)
+        
+        def report_error(number, errors):
+            click.echo(f'Line {number}: skipped, {" ".join(errors.values())}', err=True)
+        
+        with _text_stream(path, 'r') as stream:
+            result = import_items(read_records(stream, fmt), reporter_id,
+                                  batch_size=batch_size, on_error=report_error)
+        click.echo(f'{result}.')
+        
+        if result.imported and not no_match:
+            def report(progress):
+                click.echo(f'\r{progress}', nl=False)
+            
+            progress = find_all_matches(progress=report)
+            click.echo(f'\rMatched in {progress.elapsed:.1f}s: {progress}')
+    
+    @app.cli.command('export-items')
+    @click.argument('path', type=click.Path(allow_dash=True, dir_okay=False), default='-')
+    @click.option('--format', 'fmt', type=click.Choice(FORMATS), default=None,
+                  help='File format (default: from the file extension).')
+    @click.option('--matches', is_flag=True, help='Export matches instead of items.')
+    def export_items_command(path, fmt, matches):
+        """Export all items (or matches) to a CSV or JSON Lines file, or stdout."""
+        fmt = _resolve_format(path, fmt)
+        batch_size = app.config.get('EXPORT_BATCH_SIZE', 1000)
+        export = export_matches if matches else export_items
+        with _text_stream(path, 'w') as stream:
+            count = export(stream, fmt, batch_size=batch_size)
+        if path != '-':
+            click.echo(f'Exported {count} {"match(es)" if matches else "item(s)"} to {path}.')
@@ -0,0 +1,79 @@
+"""
+Database engine setup.
+Applies the SQLITE_PRAGMAS to every new SQLite connection and, when a
+read engine is configured, sends the queries of read-only views to it so
+page reads don't queue behind connections busy with matching writes.
+"""
+from functools import wraps
+from urllib.parse import quote
+from flask import current_app, g, has_request_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event
+
+def apply_sqlite_pragmas(engine, pragmas):
+    """
+    Run PRAGMA statements on every new connection of a SQLite engine.
+    
+    Args:
+        engine: SQLAlchemy engine; other databases are left alone
+        pragmas: Mapping of pragma name to value
+    """
+    if engine.dialect.name != 'sqlite' or not pragmas:
+        return
+    
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+        cursor.close()
+
+def create_read_engine(app, engine):
+    """
+    Create the engine used by read-only views, if one is configured.
+    
+    SQLALCHEMY_READ_DATABASE_URI points at a separate database such as a
+    replica. Otherwise SQLITE_READ_ONLY_CONNECTIONS opens the main SQLite
+    file a second time in read-only mode, with its own connection pool.
+    
+    Args:
+        app: Flask app
+        engine: Engine of the main database
+    
+    Returns:
+        Engine: The read engine, or None
+    """
+    uri = app.config.get('SQLALCHEMY_READ_DATABASE_URI')
+    pragmas = dict(app.config.get('SQLITE_PRAGMAS') or {})
+    if uri is None and app.config.get('SQLITE_READ_ONLY_CONNECTIONS'):
+        path = engine.url.database
+        if engine.dialect.name != 'sqlite' or path in (None, '', ':memory:'):
+            return None
+        uri = f'sqlite:///file:{quote(path)}?mode=ro&uri=true'
+        # The journal mode is a property of the file, set by the writers
+        pragmas.pop('journal_mode', None)
+    if not uri:
+        return None
+    
+    read_engine = create_engine(uri, **app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+    apply_sqlite_pragmas(read_engine, pragmas)
+    return read_engine
+
+class RoutingSession(Session):
+    """Session that runs the queries of read-only views on the read engine"""
+    
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_request_context() and g.get('read_only') \
+                and not self._flushing and not getattr(clause, 'is_dml', False):
+            read_engine = current_app.extensions.get('read_engine')
+            if read_engine is not None:
+                return read_engine
+        return super().get_bind(mapper, clause=clause, bind=bind, **kwargs)
+
+def read_only(view):
+    """Mark a view as read-only so its queries may use the read engine"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.read_only = True
+        return view(*args, **kwargs)
+    return wrapper
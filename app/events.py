@@ -0,0 +1,224 @@
+"""
+Match events pushed to browsers as server-sent events.
+The matcher queues an event for each match it saves and the events are
+published when the transaction commits, to an in-process broker that
+fans them out to the open streams of the users who reported either item.
+Browsers keep one connection open instead of polling or reloading pages.
+Streams only see events published in their own process.
+"""
+from collections import deque, namedtuple
+from flask import current_app, has_app_context
+from sqlalchemy import event
+import json
+import queue
+import threading
+import time
+from app import db
+
+# Milliseconds browsers wait before reconnecting to a closed stream
+RECONNECT_DELAY = 3000
+
+# A published event: sequence number, users it concerns, type and JSON data
+MatchEvent = namedtuple('MatchEvent', ['id', 'user_ids', 'type', 'data'])
+
+def format_event(match_event):
+    """Encode an event in the text/event-stream format"""
+    return f'id: {match_event.id}\nevent: {match_event.type}\ndata: {match_event.data}\n\n'
+
+class Subscription:
+    """Events waiting to be streamed to one browser connection"""
+    
+    def __init__(self, user_id, queue_size):
+        self.user_id = user_id
+        self.queue = queue.Queue(maxsize=queue_size)
+        # Set when the stream fell too far behind and should reconnect
+        self.closed = False
+
+class EventBroker:
+    """Thread-safe fan-out of match events to subscribed users"""
+    
+    def __init__(self, max_subscribers=100, history=1000, queue_size=100):
+        """
+        Args:
+            max_subscribers: Open streams allowed at once
+            history: Recent events kept for browsers reconnecting with Last-Event-ID
+            queue_size: Events buffered per stream before it is closed
+        """
+        self.max_subscribers = max_subscribers
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._subscriptions = {}
+        self._count = 0
+        self._history = deque(maxlen=history)
+        self._last_id = 0
+    
+    def subscribe(self, user_id, last_event_id=None):
+        """
+        Open a subscription to the events of a user.
+        
+        Args:
+            user_id: Id of the user
+            last_event_id: Id of the last event the browser received, if reconnecting
+        
+        Returns:
+            tuple: (Subscription, missed events to send first, whether events
+            may have been lost), or None if max_subscribers streams are open
+        """
+        with self._lock:
+            if self._count >= self.max_subscribers:
+                return None
+            subscription = Subscription(user_id, self.queue_size)
+            self._subscriptions.setdefault(user_id, set()).add(subscription)
+            self._count += 1
+            
+            missed, lost = [], False
+            if last_event_id is not None:
+                # Older events than the history holds, or ids from before a restart
+                oldest = self._history[0].id if self._history else self._last_id + 1
+                lost = last_event_id + 1 < oldest or last_event_id > self._last_id
+                missed = [match_event for match_event in self._history
+                          if match_event.id > last_event_id and user_id in match_event.user_ids]
+            return subscription, missed, lost
+    
+    def unsubscribe(self, subscription):
+        """Close a subscription; closing it twice is harmless"""
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id)
+            if subscriptions is None or subscription not in subscriptions:
+                return
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self._subscriptions[subscription.user_id]
+            self._count -= 1
+    
+    def publish(self, user_ids, event_type, data):
+        """
+        Send an event to every open stream of some users.
+        
+        A stream whose buffer is full is closed; the browser reconnects and
+        gets the missed events from the history.
+        
+        Args:
+            user_ids: Ids of the users the event concerns
+            event_type: Event name, e.g. 'match'
+            data: JSON-serializable event data
+        
+        Returns:
+            MatchEvent: The published event
+        """
+        user_ids = frozenset(user_ids)
+        encoded = json.dumps(data)
+        with self._lock:
+            self._last_id += 1
+            match_event = MatchEvent(self._last_id, user_ids, event_type, encoded)
+            self._history.append(match_event)
+            for user_id in user_ids:
+                for subscription in list(self._subscriptions.get(user_id, ())):
+                    try:
+                        subscription.queue.put_nowait(match_event)
+                    except queue.Full:
+                        subscription.closed = True
+                        self._subscriptions[user_id].discard(subscription)
+                        self._count -= 1
+                if not self._subscriptions.get(user_id, True):
+                    del self._subscriptions[user_id]
+        return match_event
+    
+    def stream(self, subscription, missed=(), lost=False, keepalive=15, lifetime=300):
+        """
+        Generate the text/event-stream body of a subscription.
+        
+        Keep-alive comments are sent while no events arrive so proxies and
+        dead connections are noticed. After ``lifetime`` seconds the stream
+        ends and the browser reconnects with Last-Event-ID, so an abandoned
+        connection never holds a server thread for long.
+        
+        Args:
+            subscription: Subscription from subscribe
+            missed: Events to send first
+            lost: Send a 'reset' event first, telling the page to reload
+            keepalive: Seconds between keep-alive comments
+            lifetime: Seconds before the stream ends
+        
+        Yields:
+            str: Chunks of the response body
+        """
+        try:
+            yield f'retry: {RECONNECT_DELAY}\n\n'
+            if lost:
+                yield 'event: reset\ndata: {}\n\n'
+            for match_event in missed:
+                yield format_event(match_event)
+            
+            deadline = time.monotonic() + lifetime
+            while not subscription.closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    match_event = subscription.queue.get(timeout=min(keepalive, remaining))
+                except queue.Empty:
+                    yield ': keep-alive\n\n'
+                    continue
+                yield format_event(match_event)
+        finally:
+            self.unsubscribe(subscription)
+
+def queue_event(user_ids, event_type, data):
+    """
+    Publish an event once the current transaction commits.
+    Events of a rolled back transaction are dropped.
+    
+    Args:
+        user_ids: Ids of the users the event concerns
+        event_type: Event name, e.g. 'match'
+        data: JSON-serializable event data
+    """
+    if not has_app_context() or 'event_broker' not in current_app.extensions:
+        return
+    session = db.session()
+    # Without a transaction a rollback would not reach drop_pending_events
+    if not session.in_transaction():
+        session.begin()
+    session.info.setdefault('pending_events', []).append((user_ids, event_type, data))
+
+def queue_match_events(matches):
+    """
+    Publish new or updated matches to the users who reported either item.
+    
+    Args:
+        matches: Match instances whose items are loaded or in the session
+    """
+    for match in matches:
+        user_ids = {match.lost_item.reported_by, match.found_item.reported_by}
+        queue_event(user_ids, 'match', match.to_dict())
+
+@event.listens_for(db.session, 'after_commit')
+def publish_pending_events(session):
+    """Publish the events of a committed transaction"""
+    pending = session.info.pop('pending_events', None)
+    if not pending or not has_app_context():
+        return
+    broker = current_app.extensions.get('event_broker')
+    if broker is not None:
+        for user_ids, event_type, data in pending:
+            broker.publish(user_ids, event_type, data)
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def drop_pending_events(session, previous_transaction):
+    """Events of a rolled back transaction never happened"""
+    # Also fires when nothing was sent to the database yet; savepoints keep the events
+    if not previous_transaction.nested:
+        session.info.pop('pending_events', None)
+
+def init_events(app):
+    """Create the match event broker of an app"""
+    max_streams = app.config.get('MATCH_EVENTS_MAX_STREAMS')
+    if max_streams is None:
+        # Streams hold their thread, so most threads are left to serve pages
+        max_streams = max(app.config.get('SERVER_THREADS', 8) // 4, 1)
+    app.extensions['event_broker'] = EventBroker(
+        max_subscribers=max_streams,
+        history=app.config.get('MATCH_EVENTS_HISTORY', 1000),
+        queue_size=app.config.get('MATCH_EVENTS_QUEUE_SIZE', 100)
+    )
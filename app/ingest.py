@@ -0,0 +1,155 @@
+"""
+Item ingestion shared by the report forms and the items API.
+Reports are validated, then every item of a request is inserted together
+with its match job (and, when matching runs inline, its matches) in a
+single transaction.
+"""
+from datetime import datetime, timezone
+from flask import current_app
+from app import db
+from app.models import Item, MatchJob
+from app.jobs import create_match_jobs, submit_match_jobs
+from app.uploads import save_upload
+from app.bati.utils import allowed_file
+
+class ValidationError(ValueError):
+    """Raised when reports are invalid; nothing is stored"""
+    
+    def __init__(self, errors):
+        """
+        Args:
+            errors: List of (index, {field: message}) for the invalid reports
+        """
+        super().__init__('Invalid item report')
+        self.errors = errors
+    
+    @property
+    def message(self):
+        """All error messages as one sentence"""
+        return ' '.join(message for _, fields in self.errors for message in fields.values())
+    
+    def to_dict(self):
+        """Convert errors to a list for JSON serialization"""
+        return [{'index': index, 'errors': fields} for index, fields in self.errors]
+
+def _text(value):
+    """Stripped text of a string field; anything else counts as missing"""
+    return value.strip() if isinstance(value, str) else ''
+
+def _parse_float(value, low, high):
+    """Parse a coordinate, returning None unless it lies in [low, high]"""
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return number if low <= number <= high else None
+
+def _parse_datetime(value):
+    """Parse an ISO 8601 timestamp as naive UTC, returning None if invalid"""
+    try:
+        moment = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+def validate_report(data):
+    """
+    Validate and normalize one item report.
+    
+    Args:
+        data: Mapping with title, description, category, status, latitude,
+            longitude, optional reported_at (ISO 8601) and optional image file
+    
+    Returns:
+        tuple: (cleaned fields, {field: error message})
+    """
+    errors = {}
+    title = _text(data.get('title'))
+    if not title:
+        errors['title'] = 'Title is required.'
+    elif len(title) > 200:
+        errors['title'] = 'Title must be at most 200 characters.'
+    
+    category = _text(data.get('category')) or None
+    if category and len(category) > 100:
+        errors['category'] = 'Category must be at most 100 characters.'
+    
+    status = data.get('status')
+    if status not in ('lost', 'found'):
+        errors['status'] = 'Status must be lost or found.'
+    
+    latitude = _parse_float(data.get('latitude'), -90, 90)
+    longitude = _parse_float(data.get('longitude'), -180, 180)
+    if latitude is None or longitude is None:
+        errors['location'] = 'A valid location is required.'
+    
+    reported_at = None
+    if data.get('reported_at'):
+        reported_at = _parse_datetime(data['reported_at'])
+        if reported_at is None or reported_at > datetime.utcnow():
+            errors['reported_at'] = 'Report time must be an ISO 8601 time in the past.'
+    
+    image = data.get('image')
+    if image and image.filename and \
+            not allowed_file(image.filename, current_app.config['ALLOWED_EXTENSIONS']):
+        errors['image'] = 'Image must be one of: ' + \
+            ', '.join(sorted(current_app.config['ALLOWED_EXTENSIONS'])) + '.'
+    
+    cleaned = {
+        'title': title,
+        'description': _text(data.get('description')) or None,
+        'category': category,
+        'status': status,
+        'latitude': latitude,
+        'longitude': longitude,
+        'reported_at': reported_at,
+        'image': image if image and image.filename else None
+    }
+    return cleaned, errors
+
+def ingest_items(reports, reporter_id):
+    """
+    Validate and store item reports in one transaction.
+    
+    Either every report is stored or, if any is invalid, none is.
+    
+    Args:
+        reports: List of report mappings (see validate_report)
+        reporter_id: Id of the reporting user
+    
+    Returns:
+        list: (Item, MatchJob) for each report, in order
+    
+    Raises:
+        ValidationError: If any report is invalid
+    """
+    validated = [validate_report(report) for report in reports]
+    errors = [(index, fields) for index, (_, fields) in enumerate(validated) if fields]
+    if errors:
+        raise ValidationError(errors)
+    
+    items = []
+    for cleaned, _ in validated:
+        image = cleaned.pop('image')
+        if cleaned['reported_at'] is None:
+            del cleaned['reported_at']
+        items.append(Item(image_path=save_upload(image) if image else None,
+                          reported_by=reporter_id, **cleaned))
+    
+    db.session.add_all(items)
+    db.session.flush()
+    jobs = create_match_jobs(items)
+    db.session.commit()
+    
+    # Reload the committed rows in two queries rather than one per object
+    if len(items) > 1:
+        Item.query.filter(Item.id.in_(_identities(items))).all()
+        MatchJob.query.filter(MatchJob.id.in_(_identities(jobs))).all()
+    submit_match_jobs(jobs)
+    return list(zip(items, jobs))
+
+def _identities(instances):
+    """Primary keys of persisted instances, without loading expired ones"""
+    return [db.inspect(instance).identity[0] for instance in instances]
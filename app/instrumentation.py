@@ -0,0 +1,267 @@
+"""
+Opt-in request instrumentation.
+With INSTRUMENTATION_ENABLED, each request records its wall time, the
+number and duration of its SQL statements, and the time spent rendering
+the Folium map and matching items. Every response carries a Server-Timing
+header, totals are served in the Prometheus text format at /metrics, and
+a sample of requests is profiled with cProfile, keeping the profiles of
+those slower than PROFILE_SLOW_REQUEST_MS.
+"""
+from contextlib import contextmanager
+from datetime import datetime
+import cProfile
+import os
+import random
+import threading
+import time
+from flask import current_app, g, has_app_context, has_request_context, request
+from sqlalchemy import event
+
+# Histogram buckets in seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PAIR_BUCKETS = (10, 100, 1000, 10000, 100000, 1000000)
+
+# Exported metrics: name -> (type, help text, histogram buckets)
+METRICS = {
+    'http_request_duration_seconds': ('histogram', 'Wall time of requests.', DURATION_BUCKETS),
+    'db_queries_total': ('counter', 'SQL statements executed.', None),
+    'db_query_duration_seconds_total': ('counter', 'Time spent executing SQL statements.', None),
+    'map_render_duration_seconds': ('histogram', 'Time spent rendering the Folium map.',
+                                    DURATION_BUCKETS),
+    'match_item_duration_seconds': ('histogram', 'Time spent in find_matches_for_item.',
+                                    DURATION_BUCKETS),
+    'match_item_pairs': ('histogram', 'Pairs scored per find_matches_for_item call.', PAIR_BUCKETS)
+}
+
+# Timed sections: Server-Timing name -> histogram
+SECTIONS = {
+    'map': 'map_render_duration_seconds',
+    'match': 'match_item_duration_seconds'
+}
+
+class Metrics:
+    """Thread-safe in-process counters and histograms"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+    
+    def inc(self, name, amount=1, **labels):
+        """Add to a counter"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+    
+    def observe(self, name, value, **labels):
+        """Record a value in a histogram"""
+        buckets = METRICS[name][2]
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * len(buckets), 0.0, 0]
+            for index, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram[0][index] += 1
+            histogram[1] += value
+            histogram[2] += 1
+    
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: (list(counts), total, count)
+                          for key, (counts, total, count) in self._histograms.items()}
+        
+        lines = []
+        for name, (kind, help_text, buckets) in METRICS.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            if kind == 'counter':
+                for (metric, labels), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append(f'{name}{_format_labels(labels)} {value}')
+                continue
+            for (metric, labels), (counts, total, count) in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                for bound, bucket_count in zip(buckets, counts):
+                    lines.append(f'{name}_bucket{_format_labels(labels + (("le", bound),))} '
+                                 f'{bucket_count}')
+                lines.append(f'{name}_bucket{_format_labels(labels + (("le", "+Inf"),))} {count}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {total}')
+                lines.append(f'{name}_count{_format_labels(labels)} {count}')
+        return '\n'.join(lines) + '\n'
+
+def _format_labels(labels):
+    """Prometheus label set, e.g. {endpoint="main.index"}"""
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"'
+                          for (name, _), value in zip(labels, escaped)) + '}'
+
+class RequestTimings:
+    """Time spent in the parts of one request"""
+    
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.queries = 0
+        self.query_time = 0.0
+        self.sections = {}
+        self.pairs = 0
+    
+    def add(self, section, seconds):
+        """Add time spent in a section"""
+        self.sections[section] = self.sections.get(section, 0.0) + seconds
+    
+    def server_timing(self, total):
+        """
+        Server-Timing header value.
+        
+        Args:
+            total: Wall time of the request in seconds
+        """
+        parts = [f'app;dur={total * 1000:.1f}',
+                 f'db;dur={self.query_time * 1000:.1f};desc="{self.queries} queries"']
+        for section, seconds in self.sections.items():
+            part = f'{section};dur={seconds * 1000:.1f}'
+            if section == 'match':
+                part += f';desc="{self.pairs} pairs"'
+            parts.append(part)
+        return ', '.join(parts)
+
+def _request_timings():
+    """Timings of the current request, or None outside an instrumented request"""
+    return g.get('request_timings') if has_request_context() else None
+
+def _endpoint():
+    """Endpoint label of the current request"""
+    if has_request_context():
+        return request.endpoint or 'none'
+    return 'background'
+
+def _current_metrics():
+    """Metrics of the current app, or None if instrumentation is off"""
+    return current_app.extensions.get('metrics') if has_app_context() else None
+
+@contextmanager
+def timed(section):
+    """
+    Time a section of work, such as map rendering or matching.
+    
+    The time is added to the request's Server-Timing header and to the
+    section's histogram. Does nothing unless instrumentation is enabled.
+    
+    Args:
+        section: Name in SECTIONS
+    """
+    metrics = _current_metrics()
+    if metrics is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics.observe(SECTIONS[section], elapsed)
+        timings = _request_timings()
+        if timings is not None:
+            timings.add(section, elapsed)
+
+def record_pairs(count):
+    """Record the number of pairs scored by one find_matches_for_item call"""
+    metrics = _current_metrics()
+    if metrics is None:
+        return
+    metrics.observe('match_item_pairs', count)
+    timings = _request_timings()
+    if timings is not None:
+        timings.pairs += count
+
+def _instrument_engine(engine, metrics):
+    """Count and time the SQL statements run on an engine"""
+    
+    @event.listens_for(engine, 'before_cursor_execute')
+    def start_query(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started_at', []).append(time.perf_counter())
+    
+    @event.listens_for(engine, 'after_cursor_execute')
+    def end_query(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_started_at'].pop()
+        endpoint = _endpoint()
+        metrics.inc('db_queries_total', endpoint=endpoint)
+        metrics.inc('db_query_duration_seconds_total', elapsed, endpoint=endpoint)
+        timings = _request_timings()
+        if timings is not None:
+            timings.queries += 1
+            timings.query_time += elapsed
+    
+    @event.listens_for(engine, 'handle_error')
+    def failed_query(exception_context):
+        connection = exception_context.connection
+        if connection is not None and connection.info.get('query_started_at'):
+            connection.info['query_started_at'].pop()
+
+def _save_profile(profiler, elapsed):
+    """Write a request's profile to PROFILE_DIR for inspection with pstats"""
+    directory = current_app.config.get('PROFILE_DIR') or 'profiles'
+    os.makedirs(directory, exist_ok=True)
+    name = (f'{datetime.utcnow():%Y%m%dT%H%M%S%f}-{request.method}-'
+            f'{(request.endpoint or "none").replace(".", "_")}-{elapsed * 1000:.0f}ms.prof')
+    profiler.dump_stats(os.path.join(directory, name))
+
+def init_instrumentation(app, engines):
+    """
+    Instrument an app if INSTRUMENTATION_ENABLED is set.
+    
+    Args:
+        app: Flask app
+        engines: Engines whose SQL statements are counted; None entries are skipped
+    """
+    if not app.config.get('INSTRUMENTATION_ENABLED'):
+        return
+    metrics = app.extensions['metrics'] = Metrics()
+    for engine in engines:
+        if engine is not None:
+            _instrument_engine(engine, metrics)
+    
+    slow_ms = app.config.get('PROFILE_SLOW_REQUEST_MS')
+    sample_rate = app.config.get('PROFILE_SAMPLE_RATE', 0.01)
+    
+    @app.before_request
+    def start_request():
+        g.request_timings = RequestTimings()
+        if slow_ms is not None and random.random() < sample_rate:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:  # Another profiler is active in this process
+                return
+            g.request_profiler = profiler
+    
+    @app.after_request
+    def finish_request(response):
+        timings = g.pop('request_timings', None)
+        if timings is None:
+            return response
+        elapsed = time.perf_counter() - timings.started_at
+        profiler = g.pop('request_profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            if elapsed * 1000 >= slow_ms:
+                _save_profile(profiler, elapsed)
+        
+        metrics.observe('http_request_duration_seconds', elapsed, endpoint=request.endpoint or 'none',
+                        method=request.method, status=response.status_code)
+        response.headers['Server-Timing'] = timings.server_timing(elapsed)
+        return response
+    
+    def metrics_view():
+        return current_app.response_class(metrics.render(),
+                                          mimetype='text/plain; version=0.0.4')
+    
+    app.add_url_rule(app.config.get('METRICS_PATH', '/metrics'), 'metrics', metrics_view)
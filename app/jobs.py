@@ -0,0 +1,216 @@
+"""
+Background matching queue.
+Jobs are stored in the match_job table so queued work survives restarts,
+and run on a thread pool so report requests don't wait for matching.
+Unfinished jobs are resumed by the first request a process serves, so
+CLI commands never pick them up.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from flask import current_app
+from app import db
+from app.models import Item, MatchJob
+from app.matching import find_matches_for_item, find_all_matches
+from app.events import queue_event
+from sqlalchemy import or_
+import threading
+
+class MatchQueue:
+    """Runs queued match jobs on a pool of worker threads"""
+    
+    def __init__(self, app, workers=2):
+        self.app = app
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='matching')
+        # Full recomputes get their own thread so report jobs keep flowing
+        self.recompute_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='recompute')
+        self.recompute_future = None
+        self.recompute_progress = None
+        self._lock = threading.Lock()
+        self._resumed = False
+    
+    def submit(self, job_id):
+        """Schedule a stored job to run on the pool"""
+        return self.executor.submit(self.run, job_id)
+    
+    def run(self, job_id):
+        """Run a stored job in its own app context"""
+        with self.app.app_context():
+            try:
+                run_match_job(job_id)
+            finally:
+                db.session.remove()
+    
+    def submit_recompute(self):
+        """
+        Schedule a full match recompute.
+        
+        Returns:
+            bool: False if a recompute is already running
+        """
+        with self._lock:
+            if self.recompute_future is not None and not self.recompute_future.done():
+                return False
+            self.recompute_future = self.recompute_executor.submit(self.recompute)
+            return True
+    
+    def recompute(self):
+        """Recompute all matches in its own app context, recording progress"""
+        def record(progress):
+            self.recompute_progress = progress
+        
+        with self.app.app_context():
+            try:
+                find_all_matches(progress=record)
+            except Exception:
+                self.app.logger.exception('Match recompute failed')
+            finally:
+                db.session.remove()
+    
+    def resume(self, lease):
+        """
+        Requeue pending jobs and jobs abandoned by a process that stopped.
+        
+        Jobs other processes are still running are left alone: a running job
+        is only requeued once its claim is older than the lease. Pending jobs
+        may be queued by several processes; the claim in run_match_job makes
+        sure only one runs each.
+        
+        Args:
+            lease: Seconds after which a running job is considered abandoned
+        """
+        stale = datetime.utcnow() - timedelta(seconds=lease)
+        MatchJob.query.filter(
+            MatchJob.status == 'running',
+            or_(MatchJob.claimed_at.is_(None), MatchJob.claimed_at < stale)
+        ).update({'status': 'pending'}, synchronize_session=False)
+        db.session.commit()
+        for (job_id,) in db.session.query(MatchJob.id).filter_by(status='pending').order_by(MatchJob.id):
+            self.submit(job_id)
+    
+    def resume_once(self, lease):
+        """Resume unfinished jobs the first time this is called"""
+        if self._resumed:
+            return
+        with self._lock:
+            if self._resumed:
+                return
+            self._resumed = True
+        self.resume(lease)
+
+def init_match_queue(app):
+    """Create the matching queue for an app; unfinished jobs resume on its first request"""
+    if not app.config.get('MATCHING_ASYNC', True):
+        return
+    queue = MatchQueue(app, app.config.get('MATCHING_WORKERS', 2))
+    app.extensions['match_queue'] = queue
+    lease = app.config.get('MATCHING_JOB_LEASE', 300)
+    
+    @app.before_request
+    def resume_match_jobs():
+        queue.resume_once(lease)
+
+def run_match_job(job_id):
+    """
+    Claim a pending job and find matches for its item.
+    
+    Args:
+        job_id: MatchJob id
+    
+    Returns:
+        MatchJob: The finished job, or None if another worker claimed it
+    """
+    # Claim atomically so a job is never run twice
+    claimed = MatchJob.query.filter_by(id=job_id, status='pending').update(
+        {'status': 'running', 'claimed_at': datetime.utcnow()}
+    )
+    db.session.commit()
+    if not claimed:
+        return None
+    
+    job = db.session.get(MatchJob, job_id)
+    try:
+        item = db.session.get(Item, job.item_id)
+        matches = find_matches_for_item(item)
+        job.status = 'done'
+        job.match_count = len(matches)
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.exception('Matching failed for item %s', job.item_id)
+        job.status = 'failed'
+        job.error = str(e)
+    job.finished_at = datetime.utcnow()
+    # Tells the reporter's open item page that matching is over
+    queue_event({job.item.reported_by}, 'matching', job.to_dict())
+    db.session.commit()
+    return job
+
+def create_match_jobs(items):
+    """
+    Add match jobs for new items to the current transaction.
+    
+    With MATCHING_ASYNC disabled the items are matched right away, in the
+    same transaction, and the jobs are stored as finished. A failure is
+    recorded on the job without losing the item.
+    
+    Args:
+        items: Flushed Item instances
+    
+    Returns:
+        list: MatchJob for each item; pass them to submit_match_jobs after commit
+    """
+    queue = current_app.extensions.get('match_queue')
+    jobs = []
+    for item in items:
+        job = MatchJob(item=item)
+        db.session.add(job)
+        if queue is None:
+            try:
+                with db.session.begin_nested():
+                    job.match_count = len(find_matches_for_item(item, commit=False))
+                job.status = 'done'
+            except Exception as e:
+                current_app.logger.exception('Matching failed for item %s', item.id)
+                job.status = 'failed'
+                job.error = str(e)
+            job.finished_at = datetime.utcnow()
+        jobs.append(job)
+    return jobs
+
+def submit_match_jobs(jobs):
+    """Hand committed pending jobs to the matching queue"""
+    queue = current_app.extensions.get('match_queue')
+    if queue is not None:
+        for job in jobs:
+            queue.submit(job.id)
+
+def start_recompute():
+    """
+    Start recomputing all matches in the background.
+    
+    With MATCHING_ASYNC disabled the recompute runs before returning.
+    
+    Returns:
+        bool: False if a recompute is already running
+    """
+    queue = current_app.extensions.get('match_queue')
+    if queue is None:
+        find_all_matches()
+        return True
+    return queue.submit_recompute()
+
+def get_recompute_status():
+    """
+    Return the state of the latest background recompute.
+    
+    Returns:
+        tuple: (running, RecomputeProgress or None)
+    """
+    queue = current_app.extensions.get('match_queue')
+    if queue is None:
+        return False, None
+    future = queue.recompute_future
+    return future is not None and not future.done(), queue.recompute_progress
+
+def get_latest_job(item_id):
+    """Return the most recent match job of an item, if any"""
+    return MatchJob.query.filter_by(item_id=item_id).order_by(MatchJob.id.desc()).first()
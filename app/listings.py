@@ -0,0 +1,111 @@
+"""
+Paginated listings of matches and items.
+Pages are fetched by keyset: the cursor holds the sort key of the last
+row shown and the next page starts after it, so every page costs the
+same however deep into the listing it is. Both items of each match are
+loaded with the match in the same query.
+"""
+from collections import namedtuple
+from sqlalchemy.orm import joinedload
+from app import db
+from app.models import Item, Match
+
+# One page of a listing; next_cursor is None on the last page
+Page = namedtuple('Page', ['items', 'next_cursor'])
+
+def encode_match_cursor(match):
+    """Cursor pointing just after a match in confidence order"""
+    return f'{match.confidence_score!r}_{match.id}'
+
+def decode_match_cursor(value):
+    """
+    Parse a match cursor.
+    
+    Returns:
+        tuple: (confidence_score, id), or None if missing or invalid
+    """
+    try:
+        score, match_id = value.split('_')
+        return float(score), int(match_id)
+    except (AttributeError, ValueError):
+        return None
+
+def _page(rows, limit, encode):
+    """Split the limit + 1 rows of a query into a page and its next cursor"""
+    if len(rows) > limit:
+        return Page(rows[:limit], encode(rows[limit - 1]))
+    return Page(rows, None)
+
+def get_matches_page(cursor=None, limit=50, verified=None):
+    """
+    Return one page of matches, best first.
+    
+    Args:
+        cursor: Cursor from a previous page
+        limit: Maximum number of matches
+        verified: Only verified (True) or unverified (False) matches; None for all
+    
+    Returns:
+        Page: Matches with both items loaded
+    """
+    query = Match.query.options(joinedload(Match.lost_item), joinedload(Match.found_item))
+    if verified is not None:
+        query = query.filter(Match.is_verified.is_(verified))
+    
+    position = decode_match_cursor(cursor)
+    if position is not None:
+        score, match_id = position
+        # The redundant bound on the score alone lets the index seek to the cursor
+        query = query.filter(
+            Match.confidence_score <= score,
+            db.or_(Match.confidence_score < score, Match.id < match_id)
+        )
+    
+    rows = query.order_by(Match.confidence_score.desc(), Match.id.desc()).limit(limit + 1).all()
+    return _page(rows, limit, encode_match_cursor)
+
+def get_item_matches(item):
+    """
+    Return all matches of an item, best first, with both items loaded.
+    
+    Args:
+        item: Item instance
+    
+    Returns:
+        list: Match objects
+    """
+    column = Match.lost_item_id if item.status == 'lost' else Match.found_item_id
+    return Match.query.options(joinedload(Match.lost_item), joinedload(Match.found_item)) \
+        .filter(column == item.id).order_by(Match.confidence_score.desc()).all()
+
+def get_unverified_items_page(cursor=None, limit=50):
+    """
+    Return one page of unverified items, newest first.
+    
+    Args:
+        cursor: Cursor from a previous page (the last item id shown)
+        limit: Maximum number of items
+    
+    Returns:
+        Page: Unverified items
+    """
+    query = Item.query.filter(Item.is_verified.is_(False))
+    try:
+        query = query.filter(Item.id < int(cursor))
+    except (TypeError, ValueError):
+        pass
+    rows = query.order_by(Item.id.desc()).limit(limit + 1).all()
+    return _page(rows, limit, lambda item: str(item.id))
+
+def count_unverified():
+    """
+    Count unverified items and matches in one query.
+    
+    Returns:
+        tuple: (unverified items, unverified matches)
+    """
+    unverified_items = db.select(db.func.count(Item.id)) \
+        .where(Item.is_verified.is_(False)).scalar_subquery()
+    unverified_matches = db.select(db.func.count(Match.id)) \
+        .where(Match.is_verified.is_(False)).scalar_subquery()
+    return tuple(db.session.query(unverified_items, unverified_matches).one())
@@ -0,0 +1,273 @@
+"""
+Homepage map rendering and the map data API.
+The homepage map is a marker-free Folium map rendered once; markers are
+fetched from the GeoJSON API for the visible area as the user pans and
+zooms, clustered on the server at low zoom levels.
+"""
+from app.models import Item
+from app import db
+from app.bati.cache import LRUCache
+from app.uploads import upload_url
+from app.instrumentation import timed
+from branca.element import MacroElement
+from flask import current_app, url_for
+from jinja2 import Template
+from sqlalchemy import case, func, Integer
+import folium
+
+# Rendered homepage maps, keyed by map center
+_map_cache = LRUCache(maxsize=4)
+
+# Zoom levels of web map tiles
+MIN_ZOOM, MAX_ZOOM = 0, 22
+
+class MarkerLoader(MacroElement):
+    """Loads markers for the visible area of a Folium map from the map data API"""
+    
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        (function() {
+            var map = {{ this._parent.get_name() }};
+            var layer = L.layerGroup().addTo(map);
+            var colors = {lost: 'red', found: 'green'};
+            var request = 0;
+            
+            function itemPopup(props, id) {
+                var div = document.createElement('div');
+                var title = document.createElement('h6');
+                title.textContent = props.title;
+                div.appendChild(title);
+                if (props.thumbnail) {
+                    var image = document.createElement('img');
+                    image.src = props.thumbnail;
+                    image.alt = props.title;
+                    image.loading = 'lazy';
+                    image.style.maxWidth = '160px';
+                    image.className = 'rounded mb-2';
+                    div.appendChild(image);
+                }
+                var status = document.createElement('p');
+                status.innerHTML = '<strong>Status:</strong> ';
+                status.appendChild(document.createTextNode(
+                    props.status.charAt(0).toUpperCase() + props.status.slice(1)));
+                div.appendChild(status);
+                if (props.category) {
+                    var category = document.createElement('p');
+                    category.innerHTML = '<strong>Category:</strong> ';
+                    category.appendChild(document.createTextNode(props.category));
+                    div.appendChild(category);
+                }
+                var link = document.createElement('a');
+                link.href = {{ this.item_url|tojson }} + id;
+                link.target = '_parent';
+                link.className = 'btn btn-sm btn-primary mt-2';
+                link.textContent = 'View Details';
+                div.appendChild(link);
+                return div;
+            }
+            
+            function addFeature(feature) {
+                var coords = feature.geometry.coordinates;
+                var latlng = L.latLng(coords[1], coords[0]);
+                var props = feature.properties;
+                if (props.cluster && props.count > 1) {
+                    var marker = L.circleMarker(latlng, {
+                        radius: Math.min(12 + 4 * Math.log(props.count), 40),
+                        color: '#0d6efd', fillOpacity: 0.6
+                    }).bindTooltip(String(props.count), {permanent: true, direction: 'center'});
+                    marker.on('click', function() {
+                        map.setView(latlng, Math.min(map.getZoom() + 2, map.getMaxZoom()));
+                    });
+                    marker.addTo(layer);
+                    return;
+                }
+                var id = props.cluster ? props.item_id : feature.id;
+                L.marker(latlng, {
+                    icon: L.AwesomeMarkers.icon({
+                        icon: 'info-sign', prefix: 'glyphicon',
+                        markerColor: props.verified ? 'orange' : colors[props.status]
+                    })
+                }).bindPopup(itemPopup(props, id)).addTo(layer);
+            }
+            
+            function load(url, current) {
+                fetch(url).then(function(response) { return response.json(); })
+                    .then(function(data) {
+                        if (current !== request) { return; }
+                        data.features.forEach(addFeature);
+                        if (data.next_cursor) {
+                            load(url.replace(/&cursor=\d+$/, '') + '&cursor=' + data.next_cursor, current);
+                        }
+                    });
+            }
+            
+            function refresh() {
+                var bounds = map.getBounds();
+                request += 1;
+                layer.clearLayers();
+                load({{ this.api_url|tojson }} + '?bbox=' + [
+                    bounds.getWest(), bounds.getSouth(), bounds.getEast(), bounds.getNorth()
+                ].map(function(value) { return value.toFixed(6); }).join(',') +
+                    '&zoom=' + map.getZoom(), request);
+            }
+            
+            map.on('moveend', refresh);
+            refresh();
+        })();
+        {% endmacro %}
+    """)
+    
+    def __init__(self, api_url, item_url):
+        super().__init__()
+        self._name = 'MarkerLoader'
+        self.api_url = api_url
+        self.item_url = item_url
+
+def get_items_map_html():
+    """
+    Return the homepage map HTML, rendering it on first use.
+    The map carries no markers, so it only depends on the map center.
+    """
+    default_lat = current_app.config.get('DEFAULT_LATITUDE', 37.7749)
+    default_lng = current_app.config.get('DEFAULT_LONGITUDE', -122.4194)
+    
+    map_html = _map_cache.get((default_lat, default_lng))
+    if map_html is None:
+        with timed('map'):
+            fmap = folium.Map(location=[default_lat, default_lng], zoom_start=12)
+            # The item link is completed with the item id in the browser
+            fmap.add_child(MarkerLoader(url_for('main.api_map_items'),
+                                        url_for('main.item_detail', id=0)[:-1]))
+            map_html = fmap._repr_html_()
+        _map_cache.set((default_lat, default_lng), map_html)
+    return map_html
+
+def parse_bbox(value):
+    """
+    Parse a ``west,south,east,north`` bounding box.
+    
+    Returns:
+        tuple: (west, south, east, north) as floats, or None if invalid
+    """
+    try:
+        west, south, east, north = (float(part) for part in value.split(','))
+    except (AttributeError, ValueError):
+        return None
+    if not (-90 <= south <= north <= 90):
+        return None
+    return west, south, east, north
+
+def _bbox_filter(bbox):
+    """Filter items to a bounding box, which may cross the antimeridian"""
+    west, south, east, north = bbox
+    conditions = [Item.latitude.between(south, north)]
+    if east - west < 360:
+        if west < -180 or east > 180:
+            # Leaflet reports longitudes outside [-180, 180] once the map wraps around the world
+            west = (west + 180) % 360 - 180
+            east = (east + 180) % 360 - 180
+        if west <= east:
+            conditions.append(Item.longitude.between(west, east))
+        else:
+            conditions.append(db.or_(Item.longitude >= west, Item.longitude <= east))
+    return conditions
+
+def _point(latitude, longitude):
+    """GeoJSON point geometry with coordinates rounded to about 10 cm"""
+    return {'type': 'Point', 'coordinates': [round(longitude, 6), round(latitude, 6)]}
+
+def get_map_items(bbox, cursor=None, limit=500):
+    """
+    Return one page of items inside a bounding box as GeoJSON.
+    
+    Args:
+        bbox: (west, south, east, north)
+        cursor: Only return items with a larger id
+        limit: Maximum number of features
+    
+    Returns:
+        dict: FeatureCollection with a next_cursor member, None on the last page
+    """
+    query = db.session.query(Item.id, Item.title, Item.category, Item.status,
+                             Item.latitude, Item.longitude, Item.is_verified, Item.image_path) \
+        .filter(*_bbox_filter(bbox))
+    if cursor:
+        query = query.filter(Item.id > cursor)
+    rows = query.order_by(Item.id).limit(limit + 1).all()
+    
+    features = [
+        {
+            'type': 'Feature',
+            'id': row.id,
+            'geometry': _point(row.latitude, row.longitude),
+            'properties': {
+                'title': row.title,
+                'status': row.status,
+                'category': row.category,
+                'verified': row.is_verified,
+                'thumbnail': upload_url(row.image_path, 'thumb')
+            }
+        }
+        for row in rows[:limit]
+    ]
+    return {
+        'type': 'FeatureCollection',
+        'features': features,
+        'next_cursor': rows[limit - 1].id if len(rows) > limit else None
+    }
+
+def get_map_clusters(bbox, zoom, cell_size=64):
+    """
+    Cluster the items inside a bounding box on a grid, in one grouped query.
+    
+    Args:
+        bbox: (west, south, east, north)
+        zoom: Map zoom level, which sets the grid size
+        cell_size: Grid cell size in screen pixels
+    
+    Returns:
+        dict: FeatureCollection with one feature per non-empty cell. A
+        cell holding a single item also carries that item's properties.
+    """
+    # Degrees per pixel at this zoom level on 256 pixel tiles
+    cell = cell_size * 360 / (256 * 2 ** zoom)
+    row = func.cast((Item.latitude + 90) / cell, Integer)
+    col = func.cast((Item.longitude + 180) / cell, Integer)
+    
+    cells = db.session.query(
+        func.count(Item.id).label('count'),
+        func.sum(case((Item.status == 'lost', 1), else_=0)).label('lost'),
+        func.avg(Item.latitude).label('latitude'),
+        func.avg(Item.longitude).label('longitude'),
+        # Only meaningful for single-item cells
+        func.max(Item.id).label('item_id'),
+        func.max(Item.title).label('title'),
+        func.max(Item.category).label('category'),
+        func.max(Item.status).label('status'),
+        func.max(Item.is_verified).label('verified'),
+        func.max(Item.image_path).label('image_path')
+    ).filter(*_bbox_filter(bbox)).group_by(row, col).all()
+    
+    features = []
+    for entry in cells:
+        properties = {
+            'cluster': True,
+            'count': entry.count,
+            'lost_count': entry.lost,
+            'found_count': entry.count - entry.lost
+        }
+        if entry.count == 1:
+            properties.update({
+                'item_id': entry.item_id,
+                'title': entry.title,
+                'status': entry.status,
+                'category': entry.category,
+                'verified': bool(entry.verified),
+                'thumbnail': upload_url(entry.image_path, 'thumb')
+            })
+        features.append({
+            'type': 'Feature',
+            'geometry': _point(entry.latitude, entry.longitude),
+            'properties': properties
+        })
+    return {'type': 'FeatureCollection', 'features': features, 'next_cursor': None}
@@ -2,119 +2,572 @@
 Matching engine for lost and found items.
 Uses text similarity, location proximity, and time difference.
 """
-from app.models import Item, Match, db
-from app.bati.utils import calculate_haversine_distance, calculate_text_similarity
+from app.models import DirtyItem, Item, ItemTerm, Match, db, get_counter
+from app.bati.utils import calculate_chord_distance, calculate_bounding_box
+from app.instrumentation import timed, record_pairs
+from app.events import queue_match_events
+from app.bati.scoring import (ItemRecord, item_position, score_candidates, top_k_candidates,
+                              match_time_window, init_scoring_worker, score_chunk,
+                              IdfWeights, term_vector_cache, cosine_similarity,
+                              TEXT_WEIGHT, LOCATION_WEIGHT, TIME_WEIGHT, MAX_TIME_DIFFERENCE)
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime, timedelta
 from flask import current_app
+import multiprocessing
+import time
+from sqlalchemy import func, or_, select
+from sqlalchemy.dialects import postgresql, sqlite
 
-def calculate_match_score(lost_item, found_item):
+def calculate_match_score(lost_item, found_item, idf=None):
     """
     Calculate matching score between lost and found items.
     
+    Args:
+        lost_item, found_item: Item instances
+        idf: Optional IdfWeights for the text similarity
+    
     Returns:
         float: Score between 0 and 1
     """
     # Text similarity (50% weight)
-    text_score = calculate_text_similarity(
-        f"{lost_item.title} {lost_item.description or ''}",
-        f"{found_item.title} {found_item.description or ''}"
-    )
+    text_score = cosine_similarity(term_vector_cache.get(lost_item),
+                                   term_vector_cache.get(found_item), idf)
     
     # Location proximity (30% weight)
-    distance = calculate_haversine_distance(
-        lost_item.latitude, lost_item.longitude,
-        found_item.latitude, found_item.longitude
-    )
+    distance = calculate_chord_distance(item_position(lost_item), item_position(found_item))
     threshold = current_app.config.get('LOCATION_PROXIMITY_THRESHOLD', 5000)
     location_score = max(0, 1 - (distance / threshold))
     
     # Time difference (20% weight)
     time_diff = abs((lost_item.reported_at - found_item.reported_at).total_seconds())
     # Normalize: 7 days = 0 score, 0 days = 1 score
-    max_days = 7 * 24 * 3600  # 7 days in seconds
-    time_score = max(0, 1 - (time_diff / max_days))
+    time_score = max(0, 1 - (time_diff / MAX_TIME_DIFFERENCE))
     
     # Weighted combination
-    final_score = (0.5 * text_score) + (0.3 * location_score) + (0.2 * time_score)
+    final_score = (TEXT_WEIGHT * text_score) + (LOCATION_WEIGHT * location_score) + \
+                  (TIME_WEIGHT * time_score)
     
     return final_score
 
-def find_matches_for_item(item):
+def get_idf_weights(terms=None, item_ids=None):
+    """
+    Load IDF weights from the inverted index.
+    
+    Only the document frequencies needed for scoring are loaded: those of
+    the given terms and of every term occurring in the given items. With
+    neither argument, all terms are loaded.
+    
+    Args:
+        terms: Iterable of terms
+        item_ids: Select statement producing item ids
+    
+    Returns:
+        IdfWeights: Weights over all stored items
+    """
+    query = db.session.query(ItemTerm.term, func.count()).group_by(ItemTerm.term)
+    conditions = []
+    if terms is not None:
+        conditions.append(ItemTerm.term.in_(list(terms)))
+    if item_ids is not None:
+        conditions.append(ItemTerm.term.in_(
+            select(ItemTerm.term).where(ItemTerm.item_id.in_(item_ids))
+        ))
+    if conditions:
+        query = query.filter(or_(*conditions))
+    # The maintained item counter spares a count over the whole item table
+    return IdfWeights(dict(query.all()), get_counter('items_total'))
+
+def get_time_window(min_score=None):
+    """
+    Largest report time difference between an item and its candidates.
+    
+    MATCH_TIME_WINDOW when it is set, otherwise the window outside of which
+    no pair can reach min_score.
+    
+    Args:
+        min_score: Lowest score of interest, MATCH_CONFIDENCE_THRESHOLD by default
+    
+    Returns:
+        timedelta: The window, or None for no limit
+    """
+    days = current_app.config.get('MATCH_TIME_WINDOW')
+    if days is None:
+        if min_score is None:
+            min_score = current_app.config.get('MATCH_CONFIDENCE_THRESHOLD', 0.6)
+        seconds = match_time_window(min_score)
+        return timedelta(seconds=seconds) if seconds is not None else None
+    return timedelta(days=days) if days else None
+
+def get_candidate_query(item, status, min_score=None):
+    """
+    Build the query for match candidates of a given item.
+    
+    Archived items are never candidates. The others are limited to a
+    bounding box around the item sized by MATCH_SEARCH_RADIUS, so only
+    nearby rows are fetched and scored. Items further away get a location
+    score of 0; they are skipped even though a near-identical description
+    reported around the same time could still reach the confidence threshold.
+    
+    Candidates are also limited to items reported within the time window
+    of get_time_window, through the partial index on status and reported_at.
+    
+    When location and time alone cannot reach min_score, candidates are
+    also limited to items sharing at least one term with the item through
+    the inverted index, which loses no matches.
+    
+    The bounding box trades recall for latency at the confidence threshold,
+    so it is left out when min_score is below MATCH_CONFIDENCE_THRESHOLD,
+    and the derived time window and term filter follow min_score.
+    
+    Args:
+        item: Item instance to find candidates for
+        status: Status of the candidate items ('lost' or 'found')
+        min_score: Lowest score of interest, MATCH_CONFIDENCE_THRESHOLD by default
+    
+    Returns:
+        Query: Item query for the candidates
+    """
+    query = Item.query.filter(Item.status == status, Item.archived_at.is_(None))
+    threshold = current_app.config.get('MATCH_CONFIDENCE_THRESHOLD', 0.6)
+    if min_score is None:
+        min_score = threshold
+    
+    window = get_time_window(min_score)
+    if window is not None and item.reported_at is not None:
+        query = query.filter(Item.reported_at.between(item.reported_at - window,
+                                                      item.reported_at + window))
+    
+    radius = current_app.config.get('MATCH_SEARCH_RADIUS')
+    if radius is None:
+        radius = current_app.config.get('LOCATION_PROXIMITY_THRESHOLD', 5000)
+    if radius and min_score >= threshold:
+        min_lat, max_lat, min_lon, max_lon = calculate_bounding_box(
+            item.latitude, item.longitude, radius
+        )
+        query = query.filter(
+            Item.latitude.between(min_lat, max_lat),
+            Item.longitude.between(min_lon, max_lon)
+        )
+    
+    if min_score > LOCATION_WEIGHT + TIME_WEIGHT:
+        terms = list(term_vector_cache.get(item).counts)
+        shared_terms = select(ItemTerm.item_id).where(ItemTerm.term.in_(terms))
+        query = query.filter(Item.id.in_(shared_terms))
+    
+    return query
+
+def save_matches(rows):
+    """
+    Insert new matches and update the scores of existing ones in bulk.
+    
+    On SQLite and PostgreSQL each chunk of rows is written with a single
+    INSERT ... ON CONFLICT statement against the unique pair index.
+    Other databases load the existing pairs in one query instead.
+    
+    Args:
+        rows: List of dicts with lost_item_id, found_item_id and confidence_score
+    
+    Returns:
+        list: List of the created or updated Match objects
+    """
+    dialect = db.session.get_bind().dialect.name
+    if dialect not in ('sqlite', 'postgresql'):
+        return _save_matches_by_lookup(rows)
+    
+    insert = sqlite.insert if dialect == 'sqlite' else postgresql.insert
+    matches = []
+    # Stay well below the bound parameter limit of SQLite
+    chunk_size = 500
+    for start in range(0, len(rows), chunk_size):
+        stmt = insert(Match).values(rows[start:start + chunk_size])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Match.lost_item_id, Match.found_item_id],
+            set_={'confidence_score': stmt.excluded.confidence_score}
+        )
+        matches.extend(db.session.scalars(stmt.returning(Match),
+                                          execution_options={'populate_existing': True}))
+    return matches
+
+# Score upserts of the recompute, built once per dialect
+_score_upserts = {}
+
+def _score_upsert(dialect):
+    """
+    Build the INSERT ... ON CONFLICT statement that writes recomputed scores.
+    
+    The statement targets the table rather than the model, has no RETURNING
+    and is executed with a list of rows, so SQLAlchemy compiles it once and
+    the driver runs it as an executemany.
+    
+    Args:
+        dialect: Name of the database dialect, 'sqlite' or 'postgresql'
+    
+    Returns:
+        Insert: Upsert statement taking lost_item_id, found_item_id and confidence_score
+    """
+    if dialect not in _score_upserts:
+        insert = sqlite.insert if dialect == 'sqlite' else postgresql.insert
+        stmt = insert(Match.__table__)
+        _score_upserts[dialect] = stmt.on_conflict_do_update(
+            index_elements=['lost_item_id', 'found_item_id'],
+            set_={'confidence_score': stmt.excluded.confidence_score}
+        )
+    return _score_upserts[dialect]
+
+def write_match_scores(rows):
+    """
+    Insert new matches and update the scores of existing ones without
+    loading them, for bulk writes whose matches are not needed afterwards.
+    
+    Args:
+        rows: List of dicts with lost_item_id, found_item_id and confidence_score
+    """
+    if not rows:
+        return
+    dialect = db.session.get_bind().dialect.name
+    if dialect not in ('sqlite', 'postgresql'):
+        _save_matches_by_lookup(rows)
+        return
+    db.session.connection().execute(_score_upsert(dialect), rows)
+
+def _save_matches_by_lookup(rows):
+    """Fallback of save_matches for databases without ON CONFLICT support"""
+    if not rows:
+        return []
+    lost_ids = {row['lost_item_id'] for row in rows}
+    found_ids = {row['found_item_id'] for row in rows}
+    existing = {
+        (match.lost_item_id, match.found_item_id): match
+        for match in Match.query.filter(Match.lost_item_id.in_(lost_ids),
+                                        Match.found_item_id.in_(found_ids))
+    }
+    
+    matches = []
+    for row in rows:
+        match = existing.get((row['lost_item_id'], row['found_item_id']))
+        if match:
+            match.confidence_score = row['confidence_score']
+        else:
+            match = Match(**row)
+            db.session.add(match)
+        matches.append(match)
+    return matches
+
+def drop_stale_matches(item, keep_ids):
+    """
+    Delete unverified matches of an item that no longer reach the threshold.
+    Verified matches are kept.
+    
+    Matches outside the candidate set are rescored rather than dropped
+    outright: the search radius only prunes candidates, so a pair farther
+    apart than MATCH_SEARCH_RADIUS that a full recompute saved can still
+    reach the threshold. Matches with an archived item, or with an item
+    whose status no longer pairs with this one, are always dropped.
+    
+    Args:
+        item: Item instance
+        keep_ids: Ids of the item's matches that are still current
+    
+    Returns:
+        list: Matches outside keep_ids that still reach the threshold, with updated scores
+    """
+    stale = Match.query.filter(
+        or_(Match.lost_item_id == item.id, Match.found_item_id == item.id),
+        Match.is_verified.is_(False)
+    )
+    if keep_ids:
+        stale = stale.filter(Match.id.notin_(keep_ids))
+    stale = stale.all()
+    if not stale:
+        return []
+    
+    kept = []
+    if item.status in ('lost', 'found') and item.archived_at is None:
+        threshold = current_app.config.get('MATCH_CONFIDENCE_THRESHOLD', 0.6)
+        proximity = current_app.config.get('LOCATION_PROXIMITY_THRESHOLD', 5000)
+        other_status = 'found' if item.status == 'lost' else 'lost'
+        by_other_id = {
+            match.found_item_id if item.status == 'lost' else match.lost_item_id: match
+            for match in stale
+        }
+        others = Item.query.filter(Item.id.in_(list(by_other_id)),
+                                   Item.status == other_status,
+                                   Item.archived_at.is_(None)).all()
+        if others:
+            idf = get_idf_weights(term_vector_cache.get(item).counts, [other.id for other in others])
+            for other, score in zip(others, score_candidates(item, others, proximity, idf)):
+                if score >= threshold:
+                    match = by_other_id[other.id]
+                    match.confidence_score = float(score)
+                    kept.append(match)
+    
+    kept_ids = {match.id for match in kept}
+    dropped = [match.id for match in stale if match.id not in kept_ids]
+    if dropped:
+        Match.query.filter(Match.id.in_(dropped)).delete(synchronize_session='fetch')
+    return kept
+
+@timed('match')
+def find_matches_for_item(item, commit=True):
     """
     Find potential matches for a given item.
+    All candidates are scored in one vectorized batch, and earlier
+    unverified matches of the item that no longer qualify are dropped;
+    earlier matches outside the candidate set that still qualify are kept.
+    Archived items are not matched, so all their unverified matches are dropped.
+    The saved matches are pushed to the reporters of both items on commit.
     
     Args:
         item: Item instance (lost or found)
+        commit: Commit the matches; False leaves them in the caller's transaction
     
     Returns:
         list: List of Match objects
     """
     matches = []
     threshold = current_app.config.get('MATCH_CONFIDENCE_THRESHOLD', 0.6)
+    proximity = current_app.config.get('LOCATION_PROXIMITY_THRESHOLD', 5000)
     
-    if item.status == 'lost':
-        # Find matching found items
-        found_items = Item.query.filter_by(status='found').all()
-        for found_item in found_items:
-            score = calculate_match_score(item, found_item)
-            if score >= threshold:
-                # Check if match already exists
-                existing_match = Match.query.filter_by(
-                    lost_item_id=item.id,
-                    found_item_id=found_item.id
-                ).first()
-                
-                if not existing_match:
-                    match = Match(
-                        lost_item_id=item.id,
-                        found_item_id=found_item.id,
-                        confidence_score=score
-                    )
-                    db.session.add(match)
-                    matches.append(match)
-                else:
-                    # Update existing match score
-                    existing_match.confidence_score = score
-                    matches.append(existing_match)
-    
-    elif item.status == 'found':
-        # Find matching lost items
-        lost_items = Item.query.filter_by(status='lost').all()
-        for lost_item in lost_items:
-            score = calculate_match_score(lost_item, item)
+    if item.status in ('lost', 'found') and item.archived_at is None:
+        other_status = 'found' if item.status == 'lost' else 'lost'
+        candidate_query = get_candidate_query(item, other_status)
+        candidates = candidate_query.all()
+    else:
+        candidates = []
+    record_pairs(len(candidates))
+    
+    if candidates:
+        idf = get_idf_weights(term_vector_cache.get(item).counts,
+                              candidate_query.with_entities(Item.id).statement)
+        scores = score_candidates(item, candidates, proximity, idf)
+        
+        rows = []
+        for candidate, score in zip(candidates, scores):
             if score >= threshold:
-                # Check if match already exists
-                existing_match = Match.query.filter_by(
-                    lost_item_id=lost_item.id,
-                    found_item_id=item.id
-                ).first()
-                
-                if not existing_match:
-                    match = Match(
-                        lost_item_id=lost_item.id,
-                        found_item_id=item.id,
-                        confidence_score=score
-                    )
-                    db.session.add(match)
-                    matches.append(match)
+                if item.status == 'lost':
+                    pair = {'lost_item_id': item.id, 'found_item_id': candidate.id}
                 else:
-                    # Update existing match score
-                    existing_match.confidence_score = score
-                    matches.append(existing_match)
+                    pair = {'lost_item_id': candidate.id, 'found_item_id': item.id}
+                rows.append(dict(pair, confidence_score=float(score)))
+        matches = save_matches(rows)
     
-    db.session.commit()
+    matches.extend(drop_stale_matches(item, [match.id for match in matches]))
+    queue_match_events(matches)
+    if commit:
+        db.session.commit()
     return matches
 
-def find_all_matches():
+def find_top_matches(item, k, min_score=0.0):
+    """
+    Rank the best potential matches of an item without saving them.
+    
+    Candidates are the same as for find_matches_for_item, but only their
+    scoring fields are loaded, candidates whose location and time scores
+    rule them out are never text-scored, and only the k best are kept and
+    loaded as items. Below MATCH_CONFIDENCE_THRESHOLD the candidates are
+    not pruned to the search radius, so no better candidate is missed.
+    
+    Args:
+        item: Item instance (lost or found)
+        k: Number of matches to return
+        min_score: Lowest score to return
+    
+    Returns:
+        list: Up to k (score, Item) tuples, best first
+    """
+    if item.status not in ('lost', 'found'):
+        return []
+    other_status = 'found' if item.status == 'lost' else 'lost'
+    candidate_query = get_candidate_query(item, other_status, min_score)
+    candidates = [ItemRecord(*row) for row in candidate_query.with_entities(
+        Item.id, Item.title, Item.description, Item.latitude, Item.longitude, Item.reported_at,
+        Item.unit_x, Item.unit_y, Item.unit_z
+    )]
+    if not candidates:
+        return []
+    
+    proximity = current_app.config.get('LOCATION_PROXIMITY_THRESHOLD', 5000)
+    idf = get_idf_weights(term_vector_cache.get(item).counts,
+                          candidate_query.with_entities(Item.id).statement)
+    ranked = top_k_candidates(item, candidates, k, proximity, idf, min_score)
+    items = {candidate.id: candidate for candidate in
+             Item.query.filter(Item.id.in_([record.id for _, record in ranked]))}
+    return [(score, items[record.id]) for score, record in ranked]
+
+def archive_items(item_ids=None):
+    """
+    Archive resolved items so they are no longer matched.
+    
+    Archived items keep their pages and verified matches, but they are
+    left out of candidate queries and recomputes, so the set the matcher
+    scans only grows with open reports. Their unverified matches are
+    deleted: the items are resolved, so those are no longer suggestions,
+    and the bulk update below never reaches the dirty item tracking.
+    
+    Args:
+        item_ids: Ids of the items to archive; None archives the items of every verified match
+    
+    Returns:
+        int: Number of items archived
+    """
+    if item_ids is None:
+        item_ids = select(Match.lost_item_id).where(Match.is_verified.is_(True)).union(
+            select(Match.found_item_id).where(Match.is_verified.is_(True))
+        )
+    Match.query.filter(
+        or_(Match.lost_item_id.in_(item_ids), Match.found_item_id.in_(item_ids)),
+        Match.is_verified.is_(False)
+    ).delete(synchronize_session=False)
+    query = Item.query.filter(Item.id.in_(item_ids), Item.archived_at.is_(None))
+    return query.update({'archived_at': datetime.utcnow()}, synchronize_session=False)
+
+def rematch_dirty_items(limit=None):
+    """
+    Refresh matches of items edited since they were last matched.
+    
+    Only pairs touching an item in the dirty set are rescored, so the
+    cost grows with the number of changes rather than the table size.
+    An item edited again while it is processed stays in the set.
+    
+    Args:
+        limit: Maximum number of dirty items to process
+    
+    Returns:
+        int: Number of items rematched
+    """
+    query = DirtyItem.query.order_by(DirtyItem.marked_at)
+    if limit:
+        query = query.limit(limit)
+    dirty = [(entry.item_id, entry.marked_at) for entry in query]
+    
+    for item_id, marked_at in dirty:
+        item = db.session.get(Item, item_id)
+        if item is not None:
+            find_matches_for_item(item)
+        DirtyItem.query.filter_by(item_id=item_id, marked_at=marked_at).delete()
+        db.session.commit()
+    
+    return len(dirty)
+
+class RecomputeProgress:
+    """Progress of a full match recompute"""
+    
+    def __init__(self, total_pairs):
+        self.total_pairs = total_pairs
+        self.pairs_scored = 0
+        self.matches_saved = 0
+        self.started_at = time.monotonic()
+    
+    @property
+    def elapsed(self):
+        """Seconds since the recompute started"""
+        return time.monotonic() - self.started_at
+    
+    @property
+    def rate(self):
+        """Pairs scored per second"""
+        elapsed = self.elapsed
+        return self.pairs_scored / elapsed if elapsed > 0 else 0.0
+    
+    @property
+    def eta(self):
+        """Estimated seconds until all pairs are scored, or None before the first chunk"""
+        rate = self.rate
+        if not rate:
+            return None
+        return (self.total_pairs - self.pairs_scored) / rate
+    
+    def to_dict(self):
+        """Convert progress to dictionary for JSON serialization"""
+        return {
+            'total_pairs': self.total_pairs,
+            'pairs_scored': self.pairs_scored,
+            'matches_saved': self.matches_saved,
+            'elapsed': self.elapsed,
+            'rate': self.rate,
+            'eta': self.eta
+        }
+    
+    def __str__(self):
+        percent = 100 * self.pairs_scored / self.total_pairs if self.total_pairs else 100
+        eta = f'{self.eta:.0f}s' if self.eta is not None else '?'
+        return (f'{self.pairs_scored}/{self.total_pairs} pairs ({percent:.0f}%), '
+                f'{self.rate:,.0f} pairs/s, ETA {eta}, {self.matches_saved} matches')
+
+def _load_item_records(status):
+    """Load the scoring fields of all unarchived items with a status"""
+    rows = db.session.query(Item.id, Item.title, Item.description, Item.latitude,
+                            Item.longitude, Item.reported_at, Item.unit_x, Item.unit_y,
+                            Item.unit_z).filter(
+        Item.status == status, Item.archived_at.is_(None)
+    )
+    return [ItemRecord(*row) for row in rows]
+
+def find_all_matches(workers=None, chunk_size=None, progress=None):
     """
     Recalculate all matches in the system.
-    Useful for admin operations or periodic updates.
+    Useful for admin operations or periodic updates. Archived items are skipped.
+    
+    Both sides are loaded once. The lost x found cross product is split
+    into chunks of lost items scored across a process pool, and results
+    are written back by this process in batched commits.
+    
+    Args:
+        workers: Number of worker processes (MATCHING_RECOMPUTE_WORKERS); 1 scores in-process
+        chunk_size: Lost items per chunk (MATCHING_RECOMPUTE_CHUNK_SIZE)
+        progress: Optional callable receiving a RecomputeProgress after each chunk
+    
+    Returns:
+        RecomputeProgress: Final progress with the number of matches saved
     """
-    lost_items = Item.query.filter_by(status='lost').all()
-    all_matches = []
+    threshold = current_app.config.get('MATCH_CONFIDENCE_THRESHOLD', 0.6)
+    proximity = current_app.config.get('LOCATION_PROXIMITY_THRESHOLD', 5000)
+    if workers is None:
+        workers = current_app.config.get('MATCHING_RECOMPUTE_WORKERS') or multiprocessing.cpu_count()
+    if chunk_size is None:
+        chunk_size = current_app.config.get('MATCHING_RECOMPUTE_CHUNK_SIZE', 500)
+    commit_every = current_app.config.get('MATCHING_RECOMPUTE_COMMIT_SIZE', 5000)
+    
+    lost_items = _load_item_records('lost')
+    found_items = _load_item_records('found')
+    chunks = [lost_items[start:start + chunk_size]
+              for start in range(0, len(lost_items), chunk_size)]
+    worker_args = (found_items, get_idf_weights(), proximity, threshold)
+    
+    state = RecomputeProgress(len(lost_items) * len(found_items))
+    pending_rows = []
+    
+    def collect(result):
+        pairs, pair_count = result
+        pending_rows.extend(
+            {'lost_item_id': lost_id, 'found_item_id': found_id, 'confidence_score': score}
+            for lost_id, found_id, score in pairs
+        )
+        if len(pending_rows) >= commit_every:
+            flush()
+        state.pairs_scored += pair_count
+        if progress:
+            progress(state)
+    
+    def flush():
+        write_match_scores(pending_rows)
+        db.session.commit()
+        state.matches_saved += len(pending_rows)
+        pending_rows.clear()
     
-    for lost_item in lost_items:
-        matches = find_matches_for_item(lost_item)
-        all_matches.extend(matches)
+    if workers <= 1 or len(chunks) <= 1:
+        init_scoring_worker(*worker_args)
+        for chunk in chunks:
+            collect(score_chunk(chunk))
+    else:
+        # Spawned workers avoid forking a process that runs other threads
+        with ProcessPoolExecutor(max_workers=workers,
+                                 mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=init_scoring_worker,
+                                 initargs=worker_args) as executor:
+            futures = [executor.submit(score_chunk, chunk) for chunk in chunks]
+            for future in as_completed(futures):
+                collect(future.result())
     
-    return all_matches
+    flush()
+    return state
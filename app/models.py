@@ -1,6 +1,11 @@
 from app import db, login_manager
+from app.bati.cache import TTLCache
+from app.bati.scoring import term_vector_cache
+from app.bati.utils import calculate_unit_vector
+from app.passwords import get_hasher
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy import event
+from sqlalchemy.orm import make_transient_to_detached
 from datetime import datetime
 
 class User(UserMixin, db.Model):
@@ -16,22 +21,85 @@ class User(UserMixin, db.Model):
     
     def set_password(self, password):
         """Hash and set password"""
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = get_hasher().hash(password)
     
     def check_password(self, password):
         """Verify password"""
-        return check_password_hash(self.password_hash, password)
+        return get_hasher().verify(self.password_hash, password)
+    
+    def password_needs_rehash(self):
+        """Whether the password hash was made with other than the configured parameters"""
+        return get_hasher().needs_rehash(self.password_hash)
     
     def __repr__(self):
         return f'<User {self.email}>'
 
+# Detached copies of recently loaded users, keyed by id; sized in create_app
+user_cache = TTLCache(maxsize=1024, ttl=60)
+
+def _detached_copy(user):
+    """Copy of a user's column values that is not bound to any session"""
+    copy = User(**{attr.key: getattr(user, attr.key) for attr in db.inspect(User).column_attrs})
+    make_transient_to_detached(copy)
+    return copy
+
 @login_manager.user_loader
 def load_user(user_id):
-    """Load user for Flask-Login"""
-    return User.query.get(int(user_id))
+    """
+    Load user for Flask-Login.
+    
+    Users are cached for USER_CACHE_TTL seconds, so authenticated requests
+    don't query the user table. The cached copy is merged into the current
+    session without a query; it is dropped when the user is changed or
+    deleted through the ORM.
+    """
+    user_id = int(user_id)
+    if user_cache.ttl <= 0:
+        return db.session.get(User, user_id)
+    cached = user_cache.get(user_id)
+    if cached is not None:
+        return db.session.merge(cached, load=False)
+    user = db.session.get(User, user_id)
+    if user is not None:
+        user_cache.set(user_id, _detached_copy(user))
+    return user
+
+@event.listens_for(db.session, 'after_flush')
+def forget_changed_users(session, flush_context):
+    """Drop cached users changed by a flush, and again once it is committed"""
+    changed = [obj.id for obj in (*session.dirty, *session.deleted) if isinstance(obj, User)]
+    if changed:
+        session.info.setdefault('changed_users', set()).update(changed)
+        for user_id in changed:
+            user_cache.pop(user_id)
+
+@event.listens_for(db.session, 'after_commit')
+def forget_committed_users(session):
+    """Drop users that another request may have cached before the commit"""
+    for user_id in session.info.pop('changed_users', ()):
+        user_cache.pop(user_id)
+
+@event.listens_for(db.session, 'after_rollback')
+def clear_changed_users(session):
+    """Nothing was changed by a rolled back transaction"""
+    session.info.pop('changed_users', None)
 
 class Item(db.Model):
     """Lost or Found item model"""
+    __table_args__ = (
+        # Bounding-box candidate lookups in the matcher filter on status and coordinates
+        db.Index('ix_item_status_location', 'status', 'latitude', 'longitude'),
+        # Viewport queries of the map data API filter on coordinates only
+        db.Index('ix_item_location', 'latitude', 'longitude'),
+        # Keyset pages of unverified items in the admin dashboard
+        db.Index('ix_item_verified', 'is_verified', 'id'),
+        # Match candidates of one status inside the matcher's time window;
+        # archived items are left out so the index only covers the hot set
+        db.Index('ix_item_open_status_reported', 'status', 'reported_at',
+                 sqlite_where=db.text('archived_at IS NULL'),
+                 postgresql_where=db.text('archived_at IS NULL')),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text, nullable=True)
@@ -39,10 +107,18 @@ class Item(db.Model):
     status = db.Column(db.String(20), nullable=False)  # 'lost' or 'found'
     latitude = db.Column(db.Float, nullable=False)
     longitude = db.Column(db.Float, nullable=False)
+    # Position on the unit sphere, kept in step with the coordinates so
+    # the matcher measures distances without trigonometry
+    unit_x = db.Column(db.Float, nullable=True)
+    unit_y = db.Column(db.Float, nullable=True)
+    unit_z = db.Column(db.Float, nullable=True)
     image_path = db.Column(db.String(500), nullable=True)
     reported_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     reported_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     is_verified = db.Column(db.Boolean, default=False, nullable=False)
+    # Set once the item is resolved by a verified match; archived items are
+    # kept for their pages and matches but are no longer matched
+    archived_at = db.Column(db.DateTime, nullable=True)
     
     # Relationships
     lost_matches = db.relationship('Match', foreign_keys='Match.lost_item_id', 
@@ -68,8 +144,144 @@ class Item(db.Model):
     def __repr__(self):
         return f'<Item {self.title} - {self.status}>'
 
+class ItemTerm(db.Model):
+    """Inverted index entry: a term occurring in an item's title or description"""
+    term = db.Column(db.Text, primary_key=True)
+    item_id = db.Column(db.Integer, db.ForeignKey('item.id'), primary_key=True, index=True)
+    count = db.Column(db.Integer, nullable=False)
+    
+    def __repr__(self):
+        return f'<ItemTerm {self.term} in {self.item_id}>'
+
+def index_item_terms(connection, item_id, vector):
+    """Insert the inverted index entries of an item"""
+    rows = [{'term': term, 'item_id': item_id, 'count': count}
+            for term, count in vector.counts.items()]
+    if rows:
+        connection.execute(ItemTerm.__table__.insert(), rows)
+
+def unindex_item_terms(connection, item_id):
+    """Delete the inverted index entries of an item"""
+    connection.execute(ItemTerm.__table__.delete().where(ItemTerm.item_id == item_id))
+
+@event.listens_for(Item, 'before_insert')
+@event.listens_for(Item, 'before_update')
+def locate_item(mapper, connection, target):
+    """Store the unit sphere position of a new or moved item"""
+    state = db.inspect(target)
+    if target.unit_x is None or state.attrs.latitude.history.has_changes() or \
+            state.attrs.longitude.history.has_changes():
+        target.unit_x, target.unit_y, target.unit_z = calculate_unit_vector(target.latitude,
+                                                                            target.longitude)
+
+@event.listens_for(Item, 'after_insert')
+def index_new_item(mapper, connection, target):
+    """Tokenize item text once when it is created and index its terms"""
+    index_item_terms(connection, target.id, term_vector_cache.get(target))
+
+@event.listens_for(Item, 'after_update')
+def reindex_item(mapper, connection, target):
+    """Refresh the cached vector and index entries of an edited item"""
+    state = db.inspect(target)
+    if state.attrs.title.history.has_changes() or state.attrs.description.history.has_changes():
+        unindex_item_terms(connection, target.id)
+        index_item_terms(connection, target.id, term_vector_cache.get(target))
+    else:
+        term_vector_cache.get(target)
+
+@event.listens_for(Item, 'before_delete')
+def unindex_item(mapper, connection, target):
+    """Drop the cached vector and index entries of a deleted item"""
+    unindex_item_terms(connection, target.id)
+    term_vector_cache.discard(target.id)
+
+class SiteCounter(db.Model):
+    """Named integer counter, e.g. the version of the homepage map"""
+    name = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.Integer, default=0, nullable=False)
+    
+    def __repr__(self):
+        return f'<SiteCounter {self.name}={self.value}>'
+
+def increment_counter(connection, name, amount=1):
+    """Add to a counter inside the current transaction, creating it if missing"""
+    table = SiteCounter.__table__
+    result = connection.execute(
+        table.update().where(table.c.name == name).values(value=table.c.value + amount)
+    )
+    if result.rowcount == 0:
+        connection.execute(table.insert().values(name=name, value=amount))
+
+def get_counter(name):
+    """Return the current value of a counter"""
+    value = db.session.query(SiteCounter.value).filter_by(name=name).scalar()
+    return value or 0
+
+# Item fields shown on the homepage map
+MAP_FIELDS = ('title', 'category', 'status', 'latitude', 'longitude', 'is_verified')
+
+@event.listens_for(db.session, 'after_flush')
+def bump_map_version(session, flush_context):
+    """Invalidate the cached homepage map when items shown on it change"""
+    changed = any(isinstance(obj, Item) for obj in session.new) or \
+              any(isinstance(obj, Item) for obj in session.deleted)
+    if not changed:
+        for obj in session.dirty:
+            if isinstance(obj, Item):
+                state = db.inspect(obj)
+                if any(state.attrs[field].history.has_changes() for field in MAP_FIELDS):
+                    changed = True
+                    break
+    if changed:
+        increment_counter(session.connection(), 'map_version')
+
+class DirtyItem(db.Model):
+    """Item whose matches are out of date because it was edited"""
+    item_id = db.Column(db.Integer, db.ForeignKey('item.id'), primary_key=True)
+    marked_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+    
+    def __repr__(self):
+        return f'<DirtyItem {self.item_id}>'
+
+# Item fields that feed into match scores
+MATCH_FIELDS = ('title', 'description', 'status', 'latitude', 'longitude', 'reported_at')
+
+@event.listens_for(db.session, 'after_flush')
+def mark_dirty_items(session, flush_context):
+    """Record edited items in the dirty set and drop deleted ones from it"""
+    changed_ids = []
+    for obj in session.dirty:
+        if isinstance(obj, Item) and obj.id is not None:
+            state = db.inspect(obj)
+            if any(state.attrs[field].history.has_changes() for field in MATCH_FIELDS):
+                changed_ids.append(obj.id)
+    deleted_ids = [obj.id for obj in session.deleted if isinstance(obj, Item)]
+    
+    stale_ids = changed_ids + deleted_ids
+    if not stale_ids:
+        return
+    
+    connection = session.connection()
+    table = DirtyItem.__table__
+    connection.execute(table.delete().where(table.c.item_id.in_(stale_ids)))
+    if changed_ids:
+        now = datetime.utcnow()
+        connection.execute(table.insert(), [{'item_id': item_id, 'marked_at': now}
+                                            for item_id in changed_ids])
+
 class Match(db.Model):
     """Match between lost and found items"""
+    __table_args__ = (
+        # One match per pair; also the conflict target of the matcher's upsert
+        db.Index('uq_match_items', 'lost_item_id', 'found_item_id', unique=True),
+        # Keyset pages of all matches and of verified or unverified matches, best first
+        db.Index('ix_match_confidence', 'confidence_score', 'id'),
+        db.Index('ix_match_verified_confidence', 'is_verified', 'confidence_score', 'id'),
+        # Matches of one item, best first, on the item page and in stale match cleanup
+        db.Index('ix_match_lost_confidence', 'lost_item_id', 'confidence_score'),
+        db.Index('ix_match_found_confidence', 'found_item_id', 'confidence_score'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     lost_item_id = db.Column(db.Integer, db.ForeignKey('item.id'), nullable=False)
     found_item_id = db.Column(db.Integer, db.ForeignKey('item.id'), nullable=False)
@@ -90,3 +302,85 @@ class Match(db.Model):
     
     def __repr__(self):
         return f'<Match {self.lost_item_id} <-> {self.found_item_id} ({self.confidence_score:.2f})>'
+
+# Dashboard counters kept up to date by update_site_stats
+STAT_COUNTERS = ('items_total', 'items_lost', 'items_found', 'matches_verified')
+
+def _stat_deltas(session):
+    """Changes to the dashboard counters made by the pending flush"""
+    deltas = dict.fromkeys(STAT_COUNTERS, 0)
+    
+    def count_item(status, sign):
+        deltas['items_total'] += sign
+        if status in ('lost', 'found'):
+            deltas[f'items_{status}'] += sign
+    
+    for obj in session.new:
+        if isinstance(obj, Item):
+            count_item(obj.status, 1)
+        elif isinstance(obj, Match) and obj.is_verified:
+            deltas['matches_verified'] += 1
+    for obj in session.deleted:
+        if isinstance(obj, Item):
+            history = db.inspect(obj).attrs.status.history
+            count_item(history.deleted[0] if history.deleted else obj.status, -1)
+        elif isinstance(obj, Match):
+            history = db.inspect(obj).attrs.is_verified.history
+            if (history.deleted[0] if history.deleted else obj.is_verified):
+                deltas['matches_verified'] -= 1
+    for obj in session.dirty:
+        if isinstance(obj, Item):
+            history = db.inspect(obj).attrs.status.history
+            if history.deleted and history.added:
+                count_item(history.deleted[0], -1)
+                count_item(history.added[0], 1)
+        elif isinstance(obj, Match):
+            history = db.inspect(obj).attrs.is_verified.history
+            if history.deleted and history.added and \
+                    bool(history.deleted[0]) != bool(history.added[0]):
+                deltas['matches_verified'] += 1 if history.added[0] else -1
+    return deltas
+
+@event.listens_for(db.session, 'after_flush')
+def update_site_stats(session, flush_context):
+    """Update the dashboard counters in the same transaction as the rows they count"""
+    connection = None
+    for name, amount in _stat_deltas(session).items():
+        if amount:
+            connection = connection or session.connection()
+            increment_counter(connection, name, amount)
+
+class MatchJob(db.Model):
+    """Queued background matching for a newly reported item"""
+    id = db.Column(db.Integer, primary_key=True)
+    item_id = db.Column(db.Integer, db.ForeignKey('item.id'), nullable=False, index=True)
+    status = db.Column(db.String(20), default='pending', nullable=False, index=True)  # 'pending', 'running', 'done' or 'failed'
+    match_count = db.Column(db.Integer, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    # When a worker took the job; a running job claimed longer ago than
+    # MATCHING_JOB_LEASE is taken to be abandoned by a process that died
+    claimed_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    
+    item = db.relationship('Item', backref=db.backref('match_jobs', lazy=True, cascade='all, delete-orphan'))
+    
+    @property
+    def is_pending(self):
+        """Whether the job has not finished yet"""
+        return self.status in ('pending', 'running')
+    
+    def to_dict(self):
+        """Convert job to dictionary for JSON serialization"""
+        return {
+            'id': self.id,
+            'item_id': self.item_id,
+            'status': self.status,
+            'pending': self.is_pending,
+            'match_count': self.match_count,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+    
+    def __repr__(self):
+        return f'<MatchJob {self.item_id} ({self.status})>'
@@ -0,0 +1,94 @@
+"""
+Password hashing.
+Hashes use the PASSWORD_HASH_METHOD from the config, and hashes made with
+other parameters are upgraded when their user next logs in. Hashing is
+deliberately CPU-heavy, so it runs on a small pool of PASSWORD_HASH_WORKERS
+threads: a burst of logins waits its turn in a bounded queue instead of
+taking every core from map and report requests.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
+from flask import current_app, has_app_context
+from werkzeug.security import generate_password_hash, check_password_hash
+import os
+import threading
+
+# Werkzeug's default
+DEFAULT_METHOD = 'scrypt'
+
+class HashingBusy(RuntimeError):
+    """Raised when the hashing queue stays full for PASSWORD_HASH_TIMEOUT seconds"""
+
+class PasswordHasher:
+    """Runs password hashing on a bounded thread pool"""
+    
+    def __init__(self, method, workers, queue_size, timeout):
+        """
+        Args:
+            method: Werkzeug hash method, e.g. ``scrypt:32768:8:1`` or ``pbkdf2:sha256:600000``
+            workers: Hashes computed at the same time; 0 hashes in the calling thread
+            queue_size: Hashes that may wait for a worker
+            timeout: Seconds to wait for a place in the queue before giving up
+        """
+        self.method = method
+        self.timeout = timeout
+        self._executor = None
+        self._slots = None
+        if workers:
+            self._executor = ThreadPoolExecutor(max_workers=workers,
+                                                thread_name_prefix='password-hash')
+            self._slots = threading.BoundedSemaphore(workers + queue_size)
+    
+    @cached_property
+    def prefix(self):
+        """Method with all its parameters, as stored at the start of its hashes"""
+        return generate_password_hash('', self.method).split('$', 1)[0]
+    
+    def run(self, func, *args):
+        """
+        Call a hashing function on the pool and wait for its result.
+        
+        Raises:
+            HashingBusy: If the queue is still full after the timeout
+        """
+        if self._executor is None:
+            return func(*args)
+        if not self._slots.acquire(timeout=self.timeout):
+            raise HashingBusy('Too many password hashes in progress')
+        try:
+            return self._executor.submit(func, *args).result()
+        finally:
+            self._slots.release()
+    
+    def hash(self, password):
+        """Hash a password with the configured method"""
+        return self.run(generate_password_hash, password, self.method)
+    
+    def verify(self, password_hash, password):
+        """Check a password against a stored hash"""
+        return self.run(check_password_hash, password_hash, password)
+    
+    def needs_rehash(self, password_hash):
+        """Whether a stored hash was made with other parameters than the configured method"""
+        return password_hash.split('$', 1)[0] != self.prefix
+
+def init_passwords(app):
+    """Create the password hashing pool of an app"""
+    workers = app.config.get('PASSWORD_HASH_WORKERS')
+    if workers is None:
+        workers = max(1, (os.cpu_count() or 1) // 2)
+    app.extensions['password_hasher'] = PasswordHasher(
+        app.config.get('PASSWORD_HASH_METHOD') or DEFAULT_METHOD,
+        workers,
+        app.config.get('PASSWORD_HASH_QUEUE_SIZE', 32),
+        app.config.get('PASSWORD_HASH_TIMEOUT', 5)
+    )
+
+# Used outside an app, e.g. from a shell without an app context
+_default_hasher = PasswordHasher(DEFAULT_METHOD, 0, 0, None)
+
+def get_hasher():
+    """Password hasher of the current app, or an inline one with the default method"""
+    if has_app_context():
+        return current_app.extensions.get('password_hasher', _default_hasher)
+    return _default_hasher
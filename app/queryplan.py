@@ -0,0 +1,119 @@
+"""
+Query plan audit for the app's hot queries.
+Each hot query is produced by running the code path that issues it, so
+the audited SQL is exactly what the app sends. The statements are then
+explained with EXPLAIN QUERY PLAN and plans that scan a whole table or
+sort without an index are flagged.
+"""
+from collections import namedtuple
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import event
+from app import db
+from app.models import Item, User
+from app.jobs import get_latest_job
+from app.listings import (get_matches_page, get_item_matches, get_unverified_items_page,
+                          count_unverified)
+from app.maps import get_map_items, get_map_clusters
+from app.matching import get_candidate_query, get_idf_weights, drop_stale_matches
+from app.stats import get_site_stats
+from app.bati.scoring import term_vector_cache
+
+# A hot query: a name, a callable issuing it, and plan warnings that are expected
+HotQuery = namedtuple('HotQuery', ['name', 'run', 'allow'])
+
+# Result of explaining one statement
+QueryPlan = namedtuple('QueryPlan', ['name', 'statement', 'plan', 'warnings'])
+
+# Plan details that signal a missing index
+SCAN_WARNINGS = {
+    'full table scan': lambda detail: (detail.startswith('SCAN ') and ' USING ' not in detail
+                                       and detail != 'SCAN CONSTANT ROW'),
+    'full index scan': lambda detail: detail.startswith('SCAN ') and ' INDEX ' in detail,
+    'sort without index': lambda detail: 'USE TEMP B-TREE' in detail
+}
+
+def _sample_item(status, item_id=None):
+    """Unsaved item at the default map center to feed item-specific queries"""
+    return Item(id=item_id, title='black leather wallet', description='brown card holder',
+                status=status, reported_at=datetime.utcnow(),
+                latitude=current_app.config.get('DEFAULT_LATITUDE', 37.7749),
+                longitude=current_app.config.get('DEFAULT_LONGITUDE', -122.4194))
+
+def _sample_bbox():
+    """Viewport of a few kilometers around the default map center"""
+    lat = current_app.config.get('DEFAULT_LATITUDE', 37.7749)
+    lng = current_app.config.get('DEFAULT_LONGITUDE', -122.4194)
+    return lng - 0.05, lat - 0.05, lng + 0.05, lat + 0.05
+
+def _idf_weights():
+    """IDF weights of the terms of a new item and its candidates, as loaded by the matcher"""
+    item = _sample_item('lost')
+    candidate_ids = get_candidate_query(item, 'found').with_entities(Item.id).statement
+    get_idf_weights(term_vector_cache.get(item).counts, candidate_ids)
+
+def get_hot_queries():
+    """Return the queries issued on every page view, report or match"""
+    return [
+        HotQuery('homepage statistics', get_site_stats, ()),
+        HotQuery('map items page', lambda: get_map_items(_sample_bbox(), cursor=1), ()),
+        # Grouping is on computed grid cells, which no index can provide
+        HotQuery('map clusters', lambda: get_map_clusters(_sample_bbox(), 12), ('sort without index',)),
+        HotQuery('match candidates', lambda: get_candidate_query(_sample_item('lost'), 'found').all(), ()),
+        # Groups only the rows of the item's and candidates' terms
+        HotQuery('IDF weights', _idf_weights, ('sort without index',)),
+        HotQuery('lost item matches', lambda: get_item_matches(_sample_item('lost', 0)), ()),
+        HotQuery('found item matches', lambda: get_item_matches(_sample_item('found', 0)), ()),
+        HotQuery('stale match cleanup', lambda: drop_stale_matches(_sample_item('lost', 0), [0]), ()),
+        HotQuery('matches page', lambda: get_matches_page('0.75_1'), ()),
+        HotQuery('verified matches page', lambda: get_matches_page('0.75_1', verified=True), ()),
+        HotQuery('admin unverified matches', lambda: get_matches_page('0.75_1', verified=False), ()),
+        HotQuery('admin unverified items', lambda: get_unverified_items_page('1'), ()),
+        HotQuery('admin unverified counts', count_unverified, ()),
+        HotQuery('login', lambda: User.query.filter_by(email='user@example.com').first(), ()),
+        HotQuery('matching status', lambda: get_latest_job(0), ())
+    ]
+
+def _capture_statements(run):
+    """Run a callable and return the SQL statements it executed"""
+    statements = []
+    
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+    
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        run()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+    return statements
+
+def explain_hot_queries():
+    """
+    Explain every statement issued by the hot queries.
+    
+    Statements are run inside a transaction that is rolled back, so the
+    audit never changes data.
+    
+    Returns:
+        list: QueryPlan for each statement
+    """
+    if db.engine.dialect.name != 'sqlite':
+        raise RuntimeError('Query plans can only be audited on SQLite databases')
+    
+    plans = []
+    # Some queries build URLs for their results
+    with current_app.test_request_context():
+        try:
+            for hot_query in get_hot_queries():
+                for statement, parameters in _capture_statements(hot_query.run):
+                    rows = db.session.connection().exec_driver_sql(
+                        f'EXPLAIN QUERY PLAN {statement}', parameters
+                    ).all()
+                    plan = [row[-1] for row in rows]
+                    warnings = [name for name, matches in SCAN_WARNINGS.items()
+                                if name not in hot_query.allow and any(map(matches, plan))]
+                    plans.append(QueryPlan(hot_query.name, statement, plan, warnings))
+        finally:
+            db.session.rollback()
+    return plans
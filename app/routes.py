@@ -1,71 +1,59 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, current_app
+from flask import (Blueprint, render_template, request, redirect, url_for, flash, jsonify,
+                   current_app, make_response, session, send_from_directory)
 from flask_login import login_user, logout_user, login_required, current_user
-from werkzeug.utils import secure_filename
 from app import db
-from app.models import User, Item, Match
-from app.matching import find_matches_for_item
-from app.bati.utils import allowed_file, calculate_haversine_distance
-from datetime import datetime
-import os
+from app.models import User, Item, Match, get_counter
+from app.maps import (get_items_map_html, get_map_items, get_map_clusters, parse_bbox,
+                      MIN_ZOOM, MAX_ZOOM)
+from app.database import read_only
+from app.uploads import resolve_media
+from app.stats import get_site_stats
+from app.listings import (get_matches_page, get_item_matches, get_unverified_items_page,
+                          count_unverified)
+from app.jobs import get_latest_job, start_recompute, get_recompute_status
+from app.ingest import ingest_items, ValidationError
+from app.passwords import HashingBusy
+from app.matching import find_top_matches, archive_items
+from app.events import queue_match_events
+from app.instrumentation import timed
+from app.bati.utils import calculate_haversine_distance
+import hashlib
 import folium
 
 bp = Blueprint('main', __name__)
 
 @bp.route('/')
+@read_only
 def index():
     """Homepage with map and statistics"""
-    # Get statistics
-    total_items = Item.query.count()
-    lost_count = Item.query.filter_by(status='lost').count()
-    found_count = Item.query.filter_by(status='found').count()
-    verified_matches = Match.query.filter_by(is_verified=True).count()
+    # Counters are maintained on write, so this is a single query
+    stats = get_site_stats()
     
-    # Get all items for map
-    items = Item.query.all()
-
-    # Build Folium map
-    default_lat = current_app.config.get('DEFAULT_LATITUDE', 37.7749)
-    default_lng = current_app.config.get('DEFAULT_LONGITUDE', -122.4194)
-
-    fmap = folium.Map(location=[default_lat, default_lng], zoom_start=12)
-
-    for item in items:
-        # Ensure item has valid coordinates
-        if item.latitude is None or item.longitude is None:
-            continue
-
-        # Marker color based on status/verification
-        color = 'red'
-        if item.status == 'found':
-            color = 'green'
-        if item.is_verified:
-            # Use orange to approximate "verified" yellow
-            color = 'orange'
-
-        popup_html = f"""
-        <div>
-            <h6>{item.title}</h6>
-            <p><strong>Status:</strong> {item.status.title()}</p>
-            {f'<p><strong>Category:</strong> {item.category}</p>' if item.category else ''}
-            <a href="{url_for('main.item_detail', id=item.id)}" class="btn btn-sm btn-primary mt-2">View Details</a>
-        </div>
-        """
-
-        folium.Marker(
-            location=[item.latitude, item.longitude],
-            popup=popup_html,
-            icon=folium.Icon(color=color, icon="info-sign"),
-        ).add_to(fmap)
-
-    map_html = fmap._repr_html_()
+    # Markers are loaded by the map itself, so the page only depends on
+    # the statistics and the logged-in user
+    user_key = current_user.get_id() if current_user.is_authenticated else 'anonymous'
+    etag = hashlib.sha1(
+        ':'.join([*map(str, stats.values()), user_key]).encode()
+    ).hexdigest()
     
-    return render_template('index.html',
-                         items=items,
-                         map_html=map_html,
-                         total_items=total_items,
-                         lost_count=lost_count,
-                         found_count=found_count,
-                         verified_matches=verified_matches)
+    # Pending flash messages make the page different from the cached copy
+    if '_flashes' not in session and etag in request.if_none_match:
+        response = current_app.response_class(status=304)
+    else:
+        response = make_response(render_template('index.html',
+                                 map_html=get_items_map_html(),
+                                 **stats))
+    
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def _hashing_busy(template):
+    """Ask the user to retry when password hashing is saturated"""
+    flash('Too many sign-ins right now. Please try again in a few seconds.', 'error')
+    response = make_response(render_template(template), 503)
+    response.headers['Retry-After'] = '5'
+    return response
 
 @bp.route('/register', methods=['GET', 'POST'])
 def register():
@@ -85,7 +73,10 @@ def register():
         
         # Create new user
         user = User(email=email)
-        user.set_password(password)
+        try:
+            user.set_password(password)
+        except HashingBusy:
+            return _hashing_busy('register.html')
         db.session.add(user)
         db.session.commit()
         
@@ -103,7 +94,21 @@ def login():
         
         user = User.query.filter_by(email=email).first()
         
-        if user and user.check_password(password):
+        try:
+            valid = user is not None and user.check_password(password)
+        except HashingBusy:
+            return _hashing_busy('login.html')
+        
+        if valid and user.password_needs_rehash():
+            # Upgrade the stored hash to the configured parameters
+            try:
+                user.set_password(password)
+                db.session.commit()
+            except HashingBusy:
+                # The password was verified; upgrade on a later login instead
+                current_app.logger.info('Skipped rehashing the password of user %s', user.id)
+        
+        if valid:
             login_user(user)
             next_page = request.args.get('next')
             return redirect(next_page) if next_page else redirect(url_for('main.index'))
@@ -120,151 +125,255 @@ def logout():
     flash('You have been logged out.', 'info')
     return redirect(url_for('main.index'))
 
-@bp.route('/report/lost', methods=['GET', 'POST'])
-@login_required
-def report_lost():
-    """Report a lost item"""
+def _report_item(status):
+    """Handle the report form for lost or found items"""
+    template = f'report_{status}.html'
     if request.method == 'POST':
-        title = request.form.get('title')
-        description = request.form.get('description')
-        category = request.form.get('category')
-        latitude = float(request.form.get('latitude'))
-        longitude = float(request.form.get('longitude'))
-        
-        if not title or not latitude or not longitude:
-            flash('Title and location are required.', 'error')
-            return render_template('report_lost.html')
-        
-        # Handle image upload
-        image_path = None
-        if 'image' in request.files:
-            file = request.files['image']
-            if file and file.filename:
-                if allowed_file(file.filename, current_app.config['ALLOWED_EXTENSIONS']):
-                    filename = secure_filename(file.filename)
-                    # Add timestamp to avoid collisions
-                    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_')
-                    filename = timestamp + filename
-                    filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-                    file.save(filepath)
-                    image_path = f'uploads/{filename}'
+        report = dict(request.form.to_dict(), status=status, image=request.files.get('image'))
+        try:
+            [(item, job)] = ingest_items([report], current_user.id)
+        except ValidationError as e:
+            flash(e.message, 'error')
+            return render_template(template)
         
-        # Create item
-        item = Item(
-            title=title,
-            description=description,
-            category=category,
-            status='lost',
-            latitude=latitude,
-            longitude=longitude,
-            image_path=image_path,
-            reported_by=current_user.id
-        )
-        db.session.add(item)
-        db.session.commit()
-        
-        # Find matches
-        matches = find_matches_for_item(item)
-        if matches:
-            flash(f'Item reported! Found {len(matches)} potential match(es).', 'success')
+        # Matching runs in the background unless MATCHING_ASYNC is disabled
+        if job.is_pending:
+            flash('Item reported! Looking for potential matches...', 'success')
+        elif job.match_count:
+            flash(f'Item reported! Found {job.match_count} potential match(es).', 'success')
         else:
             flash('Item reported successfully!', 'success')
         
         return redirect(url_for('main.item_detail', id=item.id))
     
-    return render_template('report_lost.html')
+    return render_template(template)
+
+@bp.route('/report/lost', methods=['GET', 'POST'])
+@login_required
+def report_lost():
+    """Report a lost item"""
+    return _report_item('lost')
 
 @bp.route('/report/found', methods=['GET', 'POST'])
 @login_required
 def report_found():
     """Report a found item"""
-    if request.method == 'POST':
-        title = request.form.get('title')
-        description = request.form.get('description')
-        category = request.form.get('category')
-        latitude = float(request.form.get('latitude'))
-        longitude = float(request.form.get('longitude'))
-        
-        if not title or not latitude or not longitude:
-            flash('Title and location are required.', 'error')
-            return render_template('report_found.html')
-        
-        # Handle image upload
-        image_path = None
-        if 'image' in request.files:
-            file = request.files['image']
-            if file and file.filename:
-                if allowed_file(file.filename, current_app.config['ALLOWED_EXTENSIONS']):
-                    filename = secure_filename(file.filename)
-                    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_')
-                    filename = timestamp + filename
-                    filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-                    file.save(filepath)
-                    image_path = f'uploads/{filename}'
-        
-        # Create item
-        item = Item(
-            title=title,
-            description=description,
-            category=category,
-            status='found',
-            latitude=latitude,
-            longitude=longitude,
-            image_path=image_path,
-            reported_by=current_user.id
-        )
-        db.session.add(item)
-        db.session.commit()
-        
-        # Find matches
-        matches = find_matches_for_item(item)
-        if matches:
-            flash(f'Item reported! Found {len(matches)} potential match(es).', 'success')
-        else:
-            flash('Item reported successfully!', 'success')
-        
-        return redirect(url_for('main.item_detail', id=item.id))
-    
-    return render_template('report_found.html')
+    return _report_item('found')
 
 @bp.route('/item/<int:id>')
+@read_only
 def item_detail(id):
     """Item detail page"""
     item = Item.query.get_or_404(id)
     
     # Get matches for this item
-    if item.status == 'lost':
-        matches = Match.query.filter_by(lost_item_id=id).order_by(Match.confidence_score.desc()).all()
-    else:
-        matches = Match.query.filter_by(found_item_id=id).order_by(Match.confidence_score.desc()).all()
+    matches = get_item_matches(item)
 
     # Build Folium map for this item
-    fmap = folium.Map(location=[item.latitude, item.longitude], zoom_start=15)
+    with timed('map'):
+        fmap = folium.Map(location=[item.latitude, item.longitude], zoom_start=15)
+        
+        color = 'red' if item.status == 'lost' else 'green'
+        
+        folium.Marker(
+            location=[item.latitude, item.longitude],
+            popup=f"<b>{item.title}</b>",
+            icon=folium.Icon(color=color, icon="info-sign"),
+        ).add_to(fmap)
+        
+        map_html = fmap._repr_html_()
+
+    job = get_latest_job(id)
+    matching_pending = job is not None and job.is_pending
+
+    return render_template('item_detail.html', item=item, matches=matches, map_html=map_html,
+                           matching_pending=matching_pending)
+
+@bp.route('/media/<path:filename>')
+def media(filename):
+    """Serve an uploaded image or one of its resized variants"""
+    filename, max_age = resolve_media(filename)
+    response = send_from_directory(current_app.config['UPLOAD_FOLDER'], filename, max_age=max_age)
+    if max_age:
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+    return response
 
-    color = 'red' if item.status == 'lost' else 'green'
+@bp.route('/api/items/<int:id>/matching')
+@read_only
+def api_matching_status(id):
+    """API endpoint for the background matching status of an item"""
+    item = Item.query.get_or_404(id)
+    job = get_latest_job(item.id)
+    if job is None:
+        return jsonify({'item_id': item.id, 'status': None, 'pending': False})
+    return jsonify(job.to_dict())
 
-    folium.Marker(
-        location=[item.latitude, item.longitude],
-        popup=f"<b>{item.title}</b>",
-        icon=folium.Icon(color=color, icon="info-sign"),
-    ).add_to(fmap)
+@bp.route('/api/matches/stream')
+@login_required
+def api_match_stream():
+    """
+    Server-sent events of new and updated matches of the current user's items.
+    
+    A 'match' event carries a match each time one is saved or verified, and
+    a 'matching' event carries the job when background matching of one of
+    the user's items finishes. Browsers reconnecting with Last-Event-ID get
+    the events they missed, or a 'reset' event if some were lost.
+    """
+    broker = current_app.extensions['event_broker']
+    subscribed = broker.subscribe(current_user.id, request.headers.get('Last-Event-ID', type=int))
+    if subscribed is None:
+        return jsonify({'error': 'Too many open event streams'}), 503
+    subscription, missed, lost = subscribed
+    
+    stream = broker.stream(subscription, missed, lost,
+                           keepalive=current_app.config.get('MATCH_EVENTS_KEEPALIVE', 15),
+                           lifetime=current_app.config.get('MATCH_EVENTS_STREAM_LIFETIME', 300))
+    response = current_app.response_class(stream, mimetype='text/event-stream')
+    # Also release the subscription if the stream is closed before it starts
+    response.call_on_close(lambda: broker.unsubscribe(subscription))
+    response.headers['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the events
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
-    map_html = fmap._repr_html_()
+@bp.route('/api/items/<int:id>/matches')
+@read_only
+def api_item_top_matches(id):
+    """
+    API endpoint ranking the best potential matches of an item.
+    
+    Scores are computed on the fly and nothing is saved. Query parameters:
+    k (number of results, capped by MATCH_TOP_K_MAX) and min_score.
+    """
+    item = Item.query.get_or_404(id)
+    max_k = current_app.config.get('MATCH_TOP_K_MAX', 50)
+    k = max(min(request.args.get('k', current_app.config.get('MATCH_TOP_K', 10), type=int),
+                max_k), 1)
+    min_score = request.args.get('min_score', 0.0, type=float)
+    ranked = find_top_matches(item, k, min_score)
+    return jsonify({'item_id': item.id, 'k': k,
+                    'matches': [{'item': candidate.to_dict(), 'score': score}
+                                for score, candidate in ranked]})
 
-    return render_template('item_detail.html', item=item, matches=matches, map_html=map_html)
+# Match listing filters and the verified state they select
+MATCH_FILTERS = {'all': None, 'verified': True, 'unverified': False}
+
+def _page_limit(setting, default=50):
+    """Page size from the limit query parameter, capped by a config setting"""
+    page_size = current_app.config.get(setting, default)
+    return max(min(request.args.get('limit', page_size, type=int), page_size), 1)
 
 @bp.route('/matches')
+@read_only
 def matches():
-    """View all matches"""
-    all_matches = Match.query.order_by(Match.confidence_score.desc()).all()
-    return render_template('matches.html', matches=all_matches)
+    """View all matches, one page at a time"""
+    match_filter = request.args.get('filter', 'all')
+    if match_filter not in MATCH_FILTERS:
+        match_filter = 'all'
+    page = get_matches_page(request.args.get('cursor'),
+                            current_app.config.get('MATCHES_PAGE_SIZE', 50),
+                            MATCH_FILTERS[match_filter])
+    return render_template('matches.html', matches=page.items, next_cursor=page.next_cursor,
+                           match_filter=match_filter)
+
+@bp.route('/api/matches')
+@read_only
+def api_matches():
+    """
+    API endpoint for matches, best first.
+    
+    Query parameters: filter (all, verified or unverified), cursor, limit.
+    """
+    match_filter = request.args.get('filter', 'all')
+    if match_filter not in MATCH_FILTERS:
+        return jsonify({'error': 'filter must be all, verified or unverified'}), 400
+    page = get_matches_page(request.args.get('cursor'), _page_limit('MATCHES_PAGE_SIZE'),
+                            MATCH_FILTERS[match_filter])
+    return jsonify({'matches': [match.to_dict() for match in page.items],
+                    'next_cursor': page.next_cursor})
 
 @bp.route('/api/items')
+@read_only
 def api_items():
     """API endpoint for items (for map)"""
     items = Item.query.all()
     return jsonify([item.to_dict() for item in items])
 
+@bp.route('/api/items', methods=['POST'])
+@login_required
+def api_create_items():
+    """
+    API endpoint to report items.
+    
+    Accepts one report object, or {"items": [...]} with up to
+    INGEST_MAX_BATCH reports stored in a single transaction. Each report
+    has title, status, latitude, longitude and optional description,
+    category and reported_at (ISO 8601).
+    """
+    data = request.get_json(silent=True)
+    if isinstance(data, dict) and 'items' in data:
+        reports = data['items']
+    else:
+        reports = [data]
+    if not isinstance(reports, list) or not all(isinstance(report, dict) for report in reports):
+        return jsonify({'error': 'Expected a report object or {"items": [...]}'}), 400
+    
+    max_batch = current_app.config.get('INGEST_MAX_BATCH', 500)
+    if not reports or len(reports) > max_batch:
+        return jsonify({'error': f'Send between 1 and {max_batch} items per request'}), 400
+    
+    # Images can only be uploaded through the report forms
+    for report in reports:
+        report.pop('image', None)
+    try:
+        results = ingest_items(reports, current_user.id)
+    except ValidationError as e:
+        return jsonify({'errors': e.to_dict()}), 400
+    
+    return jsonify({'items': [dict(item.to_dict(), matching=job.to_dict())
+                              for item, job in results]}), 201
+
+@bp.route('/api/stats')
+@read_only
+def api_stats():
+    """API endpoint for the homepage statistics"""
+    return jsonify(get_site_stats())
+
+@bp.route('/api/map/items')
+@read_only
+def api_map_items():
+    """
+    GeoJSON API for the items in the visible map area.
+    
+    Query parameters: bbox (west,south,east,north), zoom, cursor, limit.
+    Below MAP_CLUSTER_MAX_ZOOM items are clustered on a grid; above it
+    items are returned in pages, following next_cursor.
+    """
+    bbox = parse_bbox(request.args.get('bbox'))
+    if bbox is None:
+        return jsonify({'error': 'bbox must be west,south,east,north'}), 400
+    # Out of range zooms would overflow or divide by zero in the cluster grid
+    zoom = min(max(request.args.get('zoom', 18, type=int), MIN_ZOOM), MAX_ZOOM)
+    cursor = request.args.get('cursor', type=int)
+    page_size = current_app.config.get('MAP_PAGE_SIZE', 500)
+    limit = min(request.args.get('limit', page_size, type=int), page_size)
+    
+    # Responses only change when items on the map change
+    etag = hashlib.sha1(f'{get_counter("map_version")}:{request.query_string}'.encode()).hexdigest()
+    if etag in request.if_none_match:
+        response = current_app.response_class(status=304)
+    else:
+        if zoom < current_app.config.get('MAP_CLUSTER_MAX_ZOOM', 15):
+            data = get_map_clusters(bbox, zoom, current_app.config.get('MAP_CLUSTER_CELL_SIZE', 64))
+        else:
+            data = get_map_items(bbox, cursor, max(limit, 1))
+        response = jsonify(data)
+    
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
 @bp.route('/admin')
 @login_required
 def admin():
@@ -273,15 +382,61 @@ def admin():
         flash('Access denied. Admin privileges required.', 'error')
         return redirect(url_for('main.index'))
     
-    # Get unverified items
-    unverified_items = Item.query.filter_by(is_verified=False).all()
+    page_size = current_app.config.get('ADMIN_PAGE_SIZE', 50)
     
-    # Get unverified matches
-    unverified_matches = Match.query.filter_by(is_verified=False).all()
+    # Get one page each of unverified items and matches
+    items_page = get_unverified_items_page(request.args.get('items_cursor'), page_size)
+    matches_page = get_matches_page(request.args.get('matches_cursor'), page_size, verified=False)
+    unverified_item_count, unverified_match_count = count_unverified()
+    
+    recompute_running, recompute_progress = get_recompute_status()
     
     return render_template('admin.html',
-                         unverified_items=unverified_items,
-                         unverified_matches=unverified_matches)
+                         unverified_items=items_page.items,
+                         unverified_matches=matches_page.items,
+                         items_cursor=items_page.next_cursor,
+                         matches_cursor=matches_page.next_cursor,
+                         unverified_item_count=unverified_item_count,
+                         unverified_match_count=unverified_match_count,
+                         recompute_running=recompute_running,
+                         recompute_progress=recompute_progress)
+
+@bp.route('/api/admin/items')
+@login_required
+def api_admin_items():
+    """API endpoint for unverified items, newest first (admin only)"""
+    if not current_user.is_admin:
+        return jsonify({'error': 'Admin privileges required'}), 403
+    
+    page = get_unverified_items_page(request.args.get('cursor'), _page_limit('ADMIN_PAGE_SIZE'))
+    return jsonify({'items': [item.to_dict() for item in page.items],
+                    'next_cursor': page.next_cursor})
+
+@bp.route('/api/admin/matches')
+@login_required
+def api_admin_matches():
+    """API endpoint for unverified matches, best first (admin only)"""
+    if not current_user.is_admin:
+        return jsonify({'error': 'Admin privileges required'}), 403
+    
+    page = get_matches_page(request.args.get('cursor'), _page_limit('ADMIN_PAGE_SIZE'),
+                            verified=False)
+    return jsonify({'matches': [match.to_dict() for match in page.items],
+                    'next_cursor': page.next_cursor})
+
+@bp.route('/admin/recompute', methods=['POST'])
+@login_required
+def recompute_matches():
+    """Recompute all matches in the background (admin only)"""
+    if not current_user.is_admin:
+        flash('Access denied.', 'error')
+        return redirect(url_for('main.index'))
+    
+    if start_recompute():
+        flash('Recomputing all matches. Refresh this page to follow progress.', 'success')
+    else:
+        flash('A match recompute is already running.', 'info')
+    return redirect(url_for('main.admin'))
 
 @bp.route('/admin/verify/item/<int:id>')
 @login_required
@@ -308,6 +463,9 @@ def verify_match(id):
     
     match = Match.query.get_or_404(id)
     match.is_verified = True
+    # Both reports are resolved, so new reports are no longer matched against them
+    archive_items([match.lost_item_id, match.found_item_id])
+    queue_match_events([match])
     db.session.commit()
     
     flash('Match has been verified.', 'success')
@@ -0,0 +1,135 @@
+"""
+Schema upgrades for databases created by older versions of the app.
+``db.create_all()`` only creates missing tables, so anything added to
+an existing table is applied here.
+"""
+from sqlalchemy import bindparam, inspect, select, text
+from app import db
+
+# Indexes replaced by differently defined ones under a new name, by table.
+# Indexes are matched by name only, so a changed definition needs a new name.
+RETIRED_INDEXES = {
+    # Became the partial index ix_item_open_status_reported
+    'item': ['ix_item_status_reported'],
+}
+
+def upgrade_schema():
+    """
+    Bring an existing database up to date with the models.
+    Safe to run on every startup.
+    """
+    _add_missing_columns()
+    _deduplicate_matches()
+    _drop_retired_indexes()
+    _create_missing_indexes()
+    _backfill_item_positions()
+    _backfill_item_terms()
+    _backfill_site_stats()
+
+def _add_missing_columns():
+    """
+    Add columns declared on the models that are missing from the database.
+    Only nullable columns without a server default can be added this way.
+    """
+    inspector = inspect(db.engine)
+    preparer = db.engine.dialect.identifier_preparer
+    for table in db.metadata.sorted_tables:
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            with db.engine.begin() as connection:
+                connection.execute(text(f'ALTER TABLE {preparer.format_table(table)} '
+                                        f'ADD COLUMN {preparer.format_column(column)} {column_type}'))
+
+def _drop_retired_indexes():
+    """Drop the indexes in RETIRED_INDEXES that are still in the database"""
+    inspector = inspect(db.engine)
+    preparer = db.engine.dialect.identifier_preparer
+    for table_name, names in RETIRED_INDEXES.items():
+        if not inspector.has_table(table_name):
+            continue
+        existing = {index['name'] for index in inspector.get_indexes(table_name)}
+        for name in names:
+            if name in existing:
+                with db.engine.begin() as connection:
+                    connection.execute(text(f'DROP INDEX {preparer.quote(name)}'))
+
+def _create_missing_indexes():
+    """
+    Create indexes declared on the models that are missing from the database.
+    Existing indexes are matched by name; see RETIRED_INDEXES for changed ones.
+    """
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(db.engine)
+
+def _deduplicate_matches():
+    """
+    Remove duplicate matches for the same pair of items so the unique
+    index on (lost_item_id, found_item_id) can be created. A verified
+    duplicate is kept in preference to unverified ones.
+    """
+    inspector = inspect(db.engine)
+    if 'uq_match_items' in {index['name'] for index in inspector.get_indexes('match')}:
+        return
+    
+    db.session.execute(text("""
+        DELETE FROM match WHERE id NOT IN (
+            SELECT id FROM (
+                SELECT id, ROW_NUMBER() OVER (
+                    PARTITION BY lost_item_id, found_item_id
+                    ORDER BY is_verified DESC, id
+                ) AS position
+                FROM match
+            ) AS ranked WHERE position = 1
+        )
+    """))
+    db.session.commit()
+
+def _backfill_item_positions():
+    """Store the unit sphere position of items saved before it existed"""
+    from app.models import Item
+    from app.bati.utils import calculate_unit_vector
+    
+    table = Item.__table__
+    missing = select(table.c.id, table.c.latitude, table.c.longitude) \
+        .where(table.c.unit_x.is_(None)).limit(1000)
+    update = table.update().where(table.c.id == bindparam('item_id')).values(
+        unit_x=bindparam('x'), unit_y=bindparam('y'), unit_z=bindparam('z')
+    )
+    while True:
+        rows = db.session.execute(missing).all()
+        if not rows:
+            break
+        db.session.execute(update, [dict(zip(('x', 'y', 'z'), calculate_unit_vector(lat, lon)),
+                                         item_id=item_id) for item_id, lat, lon in rows])
+        db.session.commit()
+
+def _backfill_item_terms():
+    """Build the inverted text index for items stored before it existed"""
+    from app.models import Item, ItemTerm, index_item_terms
+    from app.bati.scoring import term_vector, item_text
+    
+    if db.session.query(ItemTerm.item_id).first() is not None:
+        return
+    if db.session.query(Item.id).first() is None:
+        return
+    
+    connection = db.session.connection()
+    for item in Item.query.yield_per(1000):
+        index_item_terms(connection, item.id, term_vector(item_text(item)))
+    db.session.commit()
+
+def _backfill_site_stats():
+    """Initialize the dashboard counters of databases created before they existed"""
+    from app.models import SiteCounter, STAT_COUNTERS
+    from app.stats import refresh_site_stats
+    
+    stored = SiteCounter.query.filter(SiteCounter.name.in_(STAT_COUNTERS)).count()
+    if stored < len(STAT_COUNTERS):
+        refresh_site_stats()
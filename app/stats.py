@@ -0,0 +1,59 @@
+"""
+Dashboard statistics.
+The counts shown on the homepage are kept as counters in the site_counter
+table, updated in the same transaction as the items and matches they
+count, so reading them is a single query however large the tables get.
+"""
+from sqlalchemy import case, func, select
+from app import db
+from app.models import Item, Match, SiteCounter, STAT_COUNTERS
+
+def compute_site_stats():
+    """
+    Count items and verified matches from the tables in one aggregate query.
+    
+    Returns:
+        dict: Counter name to value
+    """
+    verified_matches = select(func.count(Match.id)) \
+        .where(Match.is_verified.is_(True)).scalar_subquery()
+    row = db.session.query(
+        func.count(Item.id),
+        func.coalesce(func.sum(case((Item.status == 'lost', 1), else_=0)), 0),
+        func.coalesce(func.sum(case((Item.status == 'found', 1), else_=0)), 0),
+        verified_matches
+    ).one()
+    return dict(zip(STAT_COUNTERS, row))
+
+def refresh_site_stats():
+    """
+    Recount the dashboard counters from the tables and store them.
+    Needed after bulk writes that bypass the ORM, and to initialize the
+    counters of an existing database.
+    
+    Returns:
+        dict: Counter name to value
+    """
+    stats = compute_site_stats()
+    for name, value in stats.items():
+        db.session.merge(SiteCounter(name=name, value=value))
+    db.session.commit()
+    return stats
+
+def get_site_stats():
+    """
+    Return the dashboard counters.
+    
+    Returns:
+        dict: total_items, lost_count, found_count and verified_matches
+    """
+    counters = dict(db.session.query(SiteCounter.name, SiteCounter.value)
+                    .filter(SiteCounter.name.in_(STAT_COUNTERS)))
+    if len(counters) < len(STAT_COUNTERS):
+        counters = refresh_site_stats()
+    return {
+        'total_items': counters['items_total'],
+        'lost_count': counters['items_lost'],
+        'found_count': counters['items_found'],
+        'verified_matches': counters['matches_verified']
+    }
@@ -0,0 +1,181 @@
+"""
+Image upload storage.
+Uploads are streamed to disk in chunks while being hashed and stored
+under their SHA-256, so identical images are kept once and a stored
+file never changes. Resized WebP variants (thumbnails for lists and map
+popups, a display size for item pages) are generated off the request
+thread when Pillow is installed, and created on first request if missing.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app, url_for
+from werkzeug.security import safe_join
+import hashlib
+import os
+import re
+import tempfile
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:  # Pillow is optional; originals are served without it
+    Image = None
+
+# Stored uploads are named after the SHA-256 of their content
+CONTENT_ADDRESSED = re.compile(r'(^|/)[0-9a-f]{64}\.[^/]+$')
+
+def init_uploads(app):
+    """Create the thread pool that generates image variants for an app"""
+    workers = app.config.get('UPLOAD_VARIANT_WORKERS', 1)
+    if Image is not None and workers:
+        app.extensions['upload_executor'] = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='thumbnails'
+        )
+
+def save_upload(file):
+    """
+    Stream an uploaded file to content-addressed storage.
+    
+    The file is copied in UPLOAD_CHUNK_SIZE chunks to a temporary file in
+    the upload folder while it is hashed, then moved to
+    ``<aa>/<bb>/<sha256>.<ext>``. If an identical file is already stored
+    the copy is discarded. Variants are then generated in the background.
+    
+    Args:
+        file: Uploaded FileStorage
+    
+    Returns:
+        str: Image path relative to the static folder, e.g. ``uploads/ab/cd/abcd...jpg``
+    """
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    chunk_size = current_app.config.get('UPLOAD_CHUNK_SIZE', 64 * 1024)
+    extension = file.filename.rsplit('.', 1)[1].lower()
+    
+    digest = hashlib.sha256()
+    fd, temp_path = tempfile.mkstemp(dir=upload_folder, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as output:
+            for chunk in iter(lambda: file.stream.read(chunk_size), b''):
+                digest.update(chunk)
+                output.write(chunk)
+        
+        name = digest.hexdigest()
+        relative = f'{name[:2]}/{name[2:4]}/{name}.{extension}'
+        path = os.path.join(upload_folder, relative)
+        if os.path.exists(path):
+            os.remove(temp_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    
+    image_path = f'uploads/{relative}'
+    schedule_variants(image_path)
+    return image_path
+
+def _upload_file(image_path):
+    """Absolute path of a stored image path, or None if it escapes the upload folder"""
+    if not image_path.startswith('uploads/'):
+        return None
+    return safe_join(current_app.config['UPLOAD_FOLDER'], image_path[len('uploads/'):])
+
+def variant_path(image_path, variant):
+    """Image path of a resized variant, e.g. ``uploads/x.jpg.thumb.webp``"""
+    return f'{image_path}.{variant}.webp'
+
+def create_variant(image_path, variant):
+    """
+    Write a resized WebP copy of a stored image, unless it already exists.
+    
+    Args:
+        image_path: Stored image path
+        variant: Name of a size in UPLOAD_VARIANTS
+    
+    Returns:
+        bool: Whether the variant exists afterwards
+    """
+    size = current_app.config.get('UPLOAD_VARIANTS', {}).get(variant)
+    source = _upload_file(image_path)
+    if Image is None or size is None or source is None or not features.check('webp'):
+        return False
+    target = _upload_file(variant_path(image_path, variant))
+    if os.path.exists(target):
+        return True
+    if not os.path.exists(source):
+        return False
+    
+    try:
+        with Image.open(source) as image:
+            image = ImageOps.exif_transpose(image)
+            if image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+            image.thumbnail((size, size))
+            # Write beside the target and rename, so readers never see a partial file
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(target), suffix='.part')
+            try:
+                with os.fdopen(fd, 'wb') as output:
+                    image.save(output, 'WEBP', quality=current_app.config.get('UPLOAD_VARIANT_QUALITY', 80))
+                os.replace(temp_path, target)
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        current_app.logger.warning('Could not create %s variant of %s', variant, image_path)
+        return False
+    return True
+
+def schedule_variants(image_path):
+    """Generate all variants of a stored image on the variant thread pool"""
+    if Image is None:
+        return
+    executor = current_app.extensions.get('upload_executor')
+    app = current_app._get_current_object()
+    
+    def run():
+        with app.app_context():
+            for variant in app.config.get('UPLOAD_VARIANTS', {}):
+                create_variant(image_path, variant)
+    
+    if executor is None:
+        run()
+    else:
+        executor.submit(run)
+
+def upload_url(image_path, variant=None):
+    """
+    URL of a stored image or of one of its variants.
+    
+    Without Pillow the original image is used for every variant.
+    """
+    if not image_path:
+        return None
+    if not image_path.startswith('uploads/'):
+        return url_for('static', filename=image_path)
+    if variant is not None and Image is not None:
+        image_path = variant_path(image_path, variant)
+    return url_for('main.media', filename=image_path[len('uploads/'):])
+
+def resolve_media(filename):
+    """
+    Find the file to serve for a media URL, creating a missing variant.
+    
+    Args:
+        filename: Path below the upload folder
+    
+    Returns:
+        tuple: (filename to serve, browser cache lifetime in seconds)
+    """
+    for variant in current_app.config.get('UPLOAD_VARIANTS', {}):
+        suffix = f'.{variant}.webp'
+        if filename.endswith(suffix):
+            original = filename[:-len(suffix)]
+            if not create_variant(f'uploads/{original}', variant):
+                # Fall back to the original image
+                filename = original
+            break
+    
+    if CONTENT_ADDRESSED.search(filename):
+        # Content-addressed files never change
+        return filename, current_app.config.get('UPLOAD_CACHE_MAX_AGE', 31536000)
+    return filename, None
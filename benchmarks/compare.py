@@ -0,0 +1,48 @@
+"""
+Compare two benchmark result files written by suite.py.
+
+Prints the median of every benchmark found in both files and its change,
+flagging changes beyond the threshold as faster or slower.
+
+Usage:
+    python benchmarks/compare.py before.json after.json [--threshold 10]
+"""
+import argparse
+import json
+
+def load_medians(path):
+    """Benchmark medians of a result file, keyed by (group, name)"""
+    with open(path) as file:
+        report = json.load(file)
+    # Checks such as chord_distance_error have no timings
+    medians = {(group, name): result['median']
+               for group, results in report['results'].items()
+               for name, result in results.items() if 'median' in result}
+    return report['meta'], medians
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('before')
+    parser.add_argument('after')
+    parser.add_argument('--threshold', type=float, default=10,
+                        help='Percent change reported as faster or slower')
+    args = parser.parse_args()
+    
+    before_meta, before = load_medians(args.before)
+    after_meta, after = load_medians(args.after)
+    print(f'before: {before_meta.get("commit")}  after: {after_meta.get("commit")}')
+    print(f'{"benchmark":<36} {"before ms":>12} {"after ms":>12} {"change":>9}')
+    for key in sorted(before.keys() & after.keys()):
+        old, new = before[key], after[key]
+        change = (new - old) / old * 100 if old else 0.0
+        verdict = ''
+        if change <= -args.threshold:
+            verdict = 'faster'
+        elif change >= args.threshold:
+            verdict = 'slower'
+        print(f'{"/".join(key):<36} {old:>12.3f} {new:>12.3f} {change:>+8.1f}% {verdict}')
+    for key in sorted(before.keys() ^ after.keys()):
+        print(f'{"/".join(key):<36} only in {"before" if key in before else "after"}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+"""
+Seeded synthetic lost and found reports for benchmarks.
+
+Reports describe everyday campus items (phones, bottles, ID cards...)
+reported around a handful of hotspots such as the library or the hostels,
+clustered around DEFAULT_LATITUDE/DEFAULT_LONGITUDE. Some found reports
+describe a recently lost item in other words, near where it was lost and
+a little later, so the data has real matches as well as noise. The same
+seed always gives the same reports.
+
+Usage:
+    python benchmarks/datagen.py --count 10000 --seed 0 > items.jsonl
+    flask --app run import-items items.jsonl --reporter admin@example.com
+"""
+from collections import deque
+from datetime import datetime, timedelta
+from pathlib import Path
+import argparse
+import json
+import math
+import random
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from config import Config
+
+# Category, item names and the colors, brands and details used to describe them
+VOCABULARY = {
+    'Electronics': (['phone', 'mobile', 'laptop', 'charger', 'earphones', 'headphones',
+                     'power bank', 'calculator', 'smartwatch', 'pendrive', 'mouse'],
+                    ['samsung', 'iphone', 'oneplus', 'redmi', 'boat', 'lenovo', 'hp', 'dell',
+                     'casio', 'sandisk', 'cracked screen', 'blue case', 'type c']),
+    'Accessories': (['wallet', 'watch', 'ring', 'sunglasses', 'spectacles', 'umbrella',
+                     'cap', 'keychain', 'bracelet'],
+                    ['leather', 'brown', 'black', 'silver', 'gold', 'fastrack', 'titan',
+                     'rayban', 'folding', 'small']),
+    'Documents': (['id card', 'aadhaar card', 'license', 'hall ticket', 'atm card',
+                   'notebook', 'file', 'passport'],
+                  ['laminated', 'with photo', 'blue lanyard', 'red lanyard', 'hdfc', 'sbi',
+                   'spiral', 'physics notes', 'lab record']),
+    'Bags': (['backpack', 'bag', 'laptop bag', 'pouch', 'tote bag', 'lunch box'],
+             ['black', 'grey', 'navy', 'wildcraft', 'skybags', 'american tourister',
+              'torn strap', 'with books', 'zip pocket']),
+    'Clothing': (['jacket', 'hoodie', 'sweater', 'scarf', 'shoes', 'slippers', 'lab coat'],
+                 ['black', 'white', 'red', 'adidas', 'nike', 'puma', 'size m', 'woollen']),
+    'Keys': (['keys', 'room key', 'bike key', 'car key', 'cycle key'],
+             ['bunch of', 'honda', 'hero', 'with tag', 'hostel', 'small', 'silver']),
+    'Other': (['water bottle', 'tiffin', 'geometry box', 'pen', 'book', 'cricket bat',
+               'badminton racket', 'helmet'],
+              ['steel', 'milton', 'cello', 'yonex', 'blue', 'green', 'novel', 'textbook'])
+}
+
+# Campus hotspots: name, offset from the center in meters (north, east), spread in meters
+HOTSPOTS = [
+    ('library', (150, -80), 60), ('canteen', (-120, 200), 80), ('main gate', (-600, -350), 50),
+    ('hostel block a', (700, 450), 120), ('hostel block b', (820, 300), 120),
+    ('academic block', (50, 120), 150), ('auditorium', (-300, -50), 70),
+    ('sports ground', (400, -600), 200), ('bus stop', (-750, 100), 40),
+    ('lab complex', (250, 380), 100), ('food court', (-50, -300), 90)
+]
+
+PHRASES = {
+    'lost': ['lost near the {place}', 'last seen at the {place}', 'left in the {place}',
+             'dropped somewhere around the {place}'],
+    'found': ['found at the {place}', 'picked up near the {place}', 'was lying in the {place}',
+              'handed over at the {place}']
+}
+
+# Reports span this many days before the end time
+DEFAULT_DAYS = 30
+# End of the reporting period; fixed so the same seed gives the same data
+DEFAULT_END = datetime(2025, 1, 1)
+
+def _point(rnd, latitude, longitude, offset, spread):
+    """Random point around a hotspot, as (latitude, longitude)"""
+    north = offset[0] + rnd.gauss(0, spread)
+    east = offset[1] + rnd.gauss(0, spread)
+    return (latitude + north / 111320,
+            longitude + east / (111320 * math.cos(math.radians(latitude))))
+
+def _describe(rnd, status, category, name, place):
+    """Title and description of an item"""
+    details = rnd.sample(VOCABULARY[category][1], 2)
+    title = f'{details[0]} {name}'
+    description = f'{details[1]} {name}, {rnd.choice(PHRASES[status]).format(place=place)}'
+    return title, description
+
+def generate_reports(count, seed=0, latitude=Config.DEFAULT_LATITUDE,
+                     longitude=Config.DEFAULT_LONGITUDE, days=DEFAULT_DAYS,
+                     end=DEFAULT_END, pair_rate=0.3):
+    """
+    Generate item reports.
+    
+    Args:
+        count: Number of reports
+        seed: Random seed
+        latitude, longitude: Center of the campus
+        days: Length of the reporting period in days
+        end: End of the reporting period (naive UTC)
+        pair_rate: Share of found reports describing a recently lost item
+    
+    Yields:
+        dict: Report with title, description, category, status, latitude,
+            longitude and reported_at (ISO 8601), as accepted by import_items
+    """
+    rnd = random.Random(seed)
+    start = end - timedelta(days=days)
+    # Recent lost reports that found reports may describe again
+    recent_lost = deque(maxlen=500)
+    
+    for index in range(count):
+        # Reports arrive in order over the period, a few minutes apart at random
+        moment = start + timedelta(seconds=days * 86400 * (index + rnd.random()) / max(count, 1))
+        status = rnd.choice(('lost', 'found'))
+        
+        if status == 'found' and recent_lost and rnd.random() < pair_rate:
+            category, name, place, point, lost_at = recent_lost.popleft()
+            north, east = rnd.gauss(0, 100), rnd.gauss(0, 100)
+            point = _point(rnd, point[0], point[1], (north, east), 50)
+            moment = max(moment, lost_at + timedelta(hours=rnd.uniform(0.5, 48)))
+            moment = min(moment, end)
+        else:
+            category = rnd.choice(list(VOCABULARY))
+            name = rnd.choice(VOCABULARY[category][0])
+            place, offset, spread = rnd.choice(HOTSPOTS)
+            point = _point(rnd, latitude, longitude, offset, spread)
+            if status == 'lost':
+                recent_lost.append((category, name, place, point, moment))
+        
+        title, description = _describe(rnd, status, category, name, place)
+        yield {
+            'title': title,
+            'description': description,
+            'category': category,
+            'status': status,
+            'latitude': point[0],
+            'longitude': point[1],
+            'reported_at': moment.isoformat()
+        }
+
+def load_items(app, count, seed=0, email='bench@example.com'):
+    """
+    Create a user and insert generated items with the bulk importer.
+    
+    Args:
+        app: Flask app with an empty database
+        count: Number of items
+        seed: Random seed
+        email: Email of the reporting user, created if missing
+    
+    Returns:
+        int: Id of the reporting user
+    """
+    from app import db
+    from app.bulk import import_items
+    from app.models import User
+    with app.app_context():
+        user = User.query.filter_by(email=email).first()
+        if user is None:
+            user = User(email=email)
+            user.set_password('bench')
+            db.session.add(user)
+            db.session.commit()
+        reports = generate_reports(count, seed=seed,
+                                   latitude=app.config['DEFAULT_LATITUDE'],
+                                   longitude=app.config['DEFAULT_LONGITUDE'])
+        import_items(enumerate(reports, 1), user.id)
+        return user.id
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--count', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--days', type=int, default=DEFAULT_DAYS)
+    args = parser.parse_args()
+    
+    for report in generate_reports(args.count, seed=args.seed, days=args.days):
+        sys.stdout.write(json.dumps(report) + '\n')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+"""
+Concurrent read/write throughput of the SQLite database profiles.
+
+Reader threads request the map data API and the statistics endpoint
+while writer threads report items and match them, as during a burst of
+reports. Each profile runs against a fresh temporary database.
+
+Usage:
+    python benchmarks/sqlite_concurrency.py [--seconds 10] [--readers 4] [--writers 2]
+"""
+from pathlib import Path
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from config import Config, ProductionConfig
+
+WORDS = ('black red blue leather wallet phone keys bag backpack laptop charger '
+         'umbrella bottle card watch ring headphones notebook jacket').split()
+
+def make_app(base):
+    """Create an app using a configuration profile and an empty temporary database"""
+    from app import create_app
+    directory = tempfile.mkdtemp()
+    settings = {
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(directory, 'bench.db'),
+        'UPLOAD_FOLDER': directory,
+        'MATCHING_ASYNC': False
+    }
+    return create_app(type(base.__name__, (base,), settings))
+
+def random_item(rnd, user_id, lat, lng):
+    """Unsaved item with random words near a point"""
+    from app.models import Item
+    return Item(title=' '.join(rnd.sample(WORDS, 2)),
+                description=' '.join(rnd.choices(WORDS, k=6)),
+                status=rnd.choice(['lost', 'found']),
+                latitude=lat + rnd.gauss(0, 0.02), longitude=lng + rnd.gauss(0, 0.02),
+                reported_by=user_id)
+
+def seed(app, count):
+    """Create a user and some items; returns the user id"""
+    from app import db
+    from app.models import User
+    rnd = random.Random(0)
+    with app.app_context():
+        user = User(email='bench@example.com')
+        user.set_password('bench')
+        db.session.add(user)
+        db.session.commit()
+        lat, lng = app.config['DEFAULT_LATITUDE'], app.config['DEFAULT_LONGITUDE']
+        db.session.add_all(random_item(rnd, user.id, lat, lng) for _ in range(count))
+        db.session.commit()
+        return user.id
+
+def run_profile(base, seconds, readers, writers, items):
+    """
+    Run readers and writers against one profile for a fixed time.
+    
+    Returns:
+        dict: Throughput, read latencies and error counts
+    """
+    app = make_app(base)
+    user_id = seed(app, items)
+    lat, lng = app.config['DEFAULT_LATITUDE'], app.config['DEFAULT_LONGITUDE']
+    bbox = f'{lng - 0.05},{lat - 0.05},{lng + 0.05},{lat + 0.05}'
+    stop = threading.Event()
+    read_times, write_times, errors = [], [], []
+    
+    def reader(index):
+        client = app.test_client()
+        urls = [f'/api/map/items?bbox={bbox}&zoom=16', f'/api/map/items?bbox={bbox}&zoom=12',
+                '/api/stats']
+        count = 0
+        while not stop.is_set():
+            start = time.perf_counter()
+            response = client.get(urls[count % len(urls)])
+            if response.status_code == 200:
+                read_times.append(time.perf_counter() - start)
+            else:
+                errors.append(response.status_code)
+            count += 1
+    
+    def writer(index):
+        from app import db
+        from app.matching import find_matches_for_item
+        rnd = random.Random(index)
+        while not stop.is_set():
+            start = time.perf_counter()
+            with app.app_context():
+                try:
+                    item = random_item(rnd, user_id, lat, lng)
+                    db.session.add(item)
+                    db.session.commit()
+                    find_matches_for_item(item)
+                    write_times.append(time.perf_counter() - start)
+                except Exception as e:
+                    db.session.rollback()
+                    errors.append(type(e).__name__)
+                finally:
+                    db.session.remove()
+    
+    # Errors inside requests are reported as 500 responses
+    app.config['PROPAGATE_EXCEPTIONS'] = False
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+    threads += [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    
+    read_ms = sorted(t * 1000 for t in read_times) or [0]
+    return {
+        'profile': base.__name__,
+        'reads_per_second': len(read_times) / seconds,
+        'writes_per_second': len(write_times) / seconds,
+        'read_p50_ms': statistics.median(read_ms),
+        'read_p95_ms': read_ms[int(len(read_ms) * 0.95) - 1] if len(read_ms) > 1 else read_ms[0],
+        'read_max_ms': read_ms[-1],
+        'errors': len(errors)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--items', type=int, default=2000, help='items created before the run')
+    args = parser.parse_args()
+    
+    columns = ('profile', 'reads_per_second', 'writes_per_second',
+               'read_p50_ms', 'read_p95_ms', 'read_max_ms', 'errors')
+    print(' '.join(f'{column:>18}' for column in columns))
+    for base in (Config, ProductionConfig):
+        result = run_profile(base, args.seconds, args.readers, args.writers, args.items)
+        print(' '.join(f'{result[column]:>18.1f}' if isinstance(result[column], float)
+                       else f'{result[column]:>18}' for column in columns))
+
+if __name__ == '__main__':
+    main()
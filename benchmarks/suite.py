@@ -0,0 +1,293 @@
+"""
+Benchmark suite for the matcher and the pages.
+
+Times micro-benchmarks of the distance and text similarity functions
+(checking the chord distance against the exact haversine), a full match
+recompute and single-item matching at several data sizes, and
+test-client latency of the main pages and report endpoints, on data from
+datagen.py. Results are written as JSON; compare two runs with compare.py.
+
+Usage:
+    python benchmarks/suite.py --output results.json [--sizes 1000,10000,100000]
+    python benchmarks/suite.py --only micro,pages
+"""
+from datetime import datetime, timezone
+from pathlib import Path
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from config import Config
+from datagen import generate_reports, load_items
+
+GROUPS = ('micro', 'recompute', 'pages')
+
+def make_app(**settings):
+    """Create an app on an empty temporary database with matching inside requests"""
+    from app import create_app
+    directory = tempfile.mkdtemp()
+    settings = {
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(directory, 'bench.db'),
+        'UPLOAD_FOLDER': directory,
+        'MATCHING_ASYNC': False,
+        **settings
+    }
+    return create_app(type('BenchmarkConfig', (Config,), settings))
+
+def measure(func, repeat, number=1):
+    """
+    Time a function.
+    
+    Args:
+        func: Callable without arguments
+        repeat: Number of timed runs
+        number: Calls per run
+    
+    Returns:
+        dict: Milliseconds per call (min, median, mean, p95) and run counts
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        times.append((time.perf_counter() - start) * 1000 / number)
+    times.sort()
+    return {
+        'unit': 'ms',
+        'repeat': repeat,
+        'number': number,
+        'min': times[0],
+        'median': statistics.median(times),
+        'mean': statistics.fmean(times),
+        'p95': times[max(int(len(times) * 0.95) - 1, 0)]
+    }
+
+def check_distance_error(reports, proximity_threshold):
+    """
+    Compare chord distances with the haversine distances of every pair
+    closer than proximity_threshold.
+    
+    Raises:
+        AssertionError: If the error exceeds the bound of calculate_chord_distance
+    
+    Returns:
+        dict: Number of pairs, largest error and its bound in meters
+    """
+    import numpy as np
+    from app.bati.utils import calculate_unit_vector
+    from app.bati.scoring import EARTH_RADIUS, chord_distances, haversine_distances
+    
+    latitudes = np.radians([report['latitude'] for report in reports])
+    longitudes = np.radians([report['longitude'] for report in reports])
+    positions = np.array([calculate_unit_vector(report['latitude'], report['longitude'])
+                          for report in reports])
+    pairs, max_error, max_bound = 0, 0.0, 0.0
+    for index in range(len(reports)):
+        exact = haversine_distances(latitudes[index], longitudes[index], latitudes, longitudes)
+        errors = np.abs(chord_distances(positions[index], positions) - exact)
+        near = exact < proximity_threshold
+        # Truncation bound plus rounding of the coordinates, about a micrometer
+        bounds = exact[near] ** 3 / (24 * EARTH_RADIUS ** 2) + 1e-6
+        assert (errors[near] <= bounds).all(), 'chord distance error above its bound'
+        pairs += int(near.sum())
+        max_error = max(max_error, float(errors[near].max()))
+        max_bound = max(max_bound, float(bounds.max()))
+    return {'pairs': pairs, 'max_error_m': max_error, 'max_bound_m': max_bound}
+
+def bench_micro(args):
+    """Distance and text similarity functions on generated reports"""
+    import numpy as np
+    from app.bati.utils import (calculate_haversine_distance, calculate_chord_distance,
+                                calculate_unit_vector, calculate_text_similarity)
+    from app.bati.scoring import term_vector, cosine_similarity, haversine_distances, chord_distances
+    
+    reports = list(generate_reports(2000, seed=args.seed))
+    rnd = random.Random(args.seed)
+    pairs = [(rnd.choice(reports), rnd.choice(reports)) for _ in range(1000)]
+    texts = [(f"{a['title']} {a['description']}", f"{b['title']} {b['description']}")
+             for a, b in pairs]
+    vectors = [(term_vector(a), term_vector(b)) for a, b in texts]
+    latitudes = np.radians([report['latitude'] for report in reports])
+    longitudes = np.radians([report['longitude'] for report in reports])
+    positions = np.array([calculate_unit_vector(report['latitude'], report['longitude'])
+                          for report in reports])
+    position_pairs = [(calculate_unit_vector(a['latitude'], a['longitude']),
+                       calculate_unit_vector(b['latitude'], b['longitude'])) for a, b in pairs]
+    
+    def haversine():
+        for a, b in pairs:
+            calculate_haversine_distance(a['latitude'], a['longitude'], b['latitude'], b['longitude'])
+    
+    def chord():
+        for a, b in position_pairs:
+            calculate_chord_distance(a, b)
+    
+    def haversine_vectorized():
+        haversine_distances(latitudes[0], longitudes[0], latitudes, longitudes)
+    
+    def chord_vectorized():
+        chord_distances(positions[0], positions)
+    
+    def text_similarity():
+        for a, b in texts:
+            calculate_text_similarity(a, b)
+    
+    def term_vectors():
+        for a, _ in texts:
+            term_vector(a)
+    
+    def cosine():
+        for a, b in vectors:
+            cosine_similarity(a, b)
+    
+    repeat = args.repeat * 4
+    return {
+        # 1000 calls per run
+        'haversine_x1000': measure(haversine, repeat),
+        'chord_x1000': measure(chord, repeat),
+        'haversine_distances_2000': measure(haversine_vectorized, repeat, number=10),
+        'chord_distances_2000': measure(chord_vectorized, repeat, number=10),
+        'text_similarity_x1000': measure(text_similarity, repeat),
+        'term_vector_x1000': measure(term_vectors, repeat),
+        'cosine_similarity_x1000': measure(cosine, repeat),
+        'chord_distance_error': check_distance_error(reports, Config.LOCATION_PROXIMITY_THRESHOLD)
+    }
+
+def bench_recompute(args):
+    """Full recompute and single-item matching at each data size"""
+    from app.matching import find_all_matches, find_matches_for_item
+    from app.models import Item
+    
+    results = {}
+    for size in args.sizes:
+        app = make_app(MATCHING_RECOMPUTE_WORKERS=args.workers)
+        start = time.perf_counter()
+        load_items(app, size, seed=args.seed)
+        load_ms = (time.perf_counter() - start) * 1000
+        
+        with app.app_context():
+            start = time.perf_counter()
+            progress = find_all_matches()
+            elapsed = time.perf_counter() - start
+            results[f'recompute_{size}'] = {
+                'unit': 'ms', 'repeat': 1, 'number': 1,
+                'min': elapsed * 1000, 'median': elapsed * 1000, 'mean': elapsed * 1000,
+                'p95': elapsed * 1000,
+                'pairs': progress.total_pairs,
+                'pairs_per_second': progress.total_pairs / elapsed if elapsed else None,
+                'matches': progress.matches_saved,
+                'load_ms': load_ms
+            }
+            
+            # Rematch a fixed sample of items, as when they are reported
+            rnd = random.Random(args.seed)
+            ids = rnd.sample(range(1, size + 1), min(args.repeat, size))
+            items = iter(Item.query.filter(Item.id.in_(ids)).all())
+            results[f'match_item_{size}'] = measure(lambda: find_matches_for_item(next(items)),
+                                                    len(ids))
+    return results
+
+def bench_pages(args):
+    """Test-client latency of the pages and endpoints, with matches computed"""
+    from app.matching import find_all_matches
+    
+    app = make_app(MATCHING_RECOMPUTE_WORKERS=1)
+    load_items(app, args.page_items, seed=args.seed)
+    with app.app_context():
+        find_all_matches()
+    
+    client = app.test_client()
+    client.post('/login', data={'email': 'bench@example.com', 'password': 'bench'})
+    # Reports posted during the benchmark, distinct from the loaded ones
+    reports = generate_reports(args.repeat * 3, seed=args.seed + 1)
+    
+    def get(url):
+        def request():
+            response = client.get(url)
+            assert response.status_code == 200, (url, response.status_code)
+        return request
+    
+    def post_report(status):
+        def request():
+            report = {key: str(value) for key, value in next(reports).items()}
+            report['status'] = status
+            response = client.post(f'/report/{status}', data=report)
+            assert response.status_code == 302, (status, response.status_code)
+        return request
+    
+    def post_api():
+        response = client.post('/api/items', json=next(reports))
+        assert response.status_code == 201, response.status_code
+    
+    return {
+        'index': measure(get('/'), args.repeat),
+        'matches': measure(get('/matches'), args.repeat),
+        'api_items': measure(get('/api/items'), args.repeat),
+        'report_form': measure(get('/report/lost'), args.repeat),
+        'report_lost': measure(post_report('lost'), args.repeat),
+        'report_found': measure(post_report('found'), args.repeat),
+        'api_create_item': measure(post_api, args.repeat)
+    }
+
+def _git_commit():
+    """Commit of the working tree, or None outside a git checkout"""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True,
+                              cwd=Path(__file__).resolve().parent).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--output', help='JSON file to write (default: stdout)')
+    parser.add_argument('--only', default=','.join(GROUPS),
+                        help=f'Comma-separated groups to run: {", ".join(GROUPS)}')
+    parser.add_argument('--sizes', default='1000,10000',
+                        help='Item counts of the recompute benchmarks, e.g. 1000,10000,100000')
+    parser.add_argument('--page-items', type=int, default=2000,
+                        help='Items loaded for the page benchmarks')
+    parser.add_argument('--repeat', type=int, default=20, help='Timed runs per benchmark')
+    parser.add_argument('--workers', type=int, default=1, help='Recompute worker processes')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    args.sizes = [int(size) for size in args.sizes.split(',') if size]
+    groups = [group for group in args.only.split(',') if group]
+    unknown = set(groups) - set(GROUPS)
+    if unknown:
+        parser.error(f'unknown groups: {", ".join(sorted(unknown))}')
+    
+    benchmarks = {'micro': bench_micro, 'recompute': bench_recompute, 'pages': bench_pages}
+    results = {}
+    for group in groups:
+        print(f'Running {group} benchmarks...', file=sys.stderr)
+        results[group] = benchmarks[group](args)
+    
+    report = {
+        'meta': {
+            'commit': _git_commit(),
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'args': {key: value for key, value in vars(args).items() if key != 'output'}
+        },
+        'results': results
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + '\n')
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Authenticated request throughput with and without the user cache.
+
+Logged-in test clients request cheap authenticated pages (a revalidated
+homepage answered with 304 and the report form), so loading the user is
+a large share of each request. Each setting runs against a fresh
+temporary database.
+
+Usage:
+    python benchmarks/user_loader.py [--requests 2000] [--users 50]
+"""
+from pathlib import Path
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from config import Config
+
+def make_app(user_cache_ttl):
+    """Create an app with a user cache TTL and an empty temporary database"""
+    from app import create_app
+    directory = tempfile.mkdtemp()
+    settings = {
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(directory, 'bench.db'),
+        'UPLOAD_FOLDER': directory,
+        'USER_CACHE_TTL': user_cache_ttl
+    }
+    return create_app(type('BenchmarkConfig', (Config,), settings))
+
+def logged_in_clients(app, users):
+    """Create users and return a test client logged in as each of them"""
+    from app import db
+    from app.models import User
+    with app.app_context():
+        for index in range(users):
+            user = User(email=f'user{index}@example.com')
+            user.set_password('bench')
+            db.session.add(user)
+        db.session.commit()
+    clients = []
+    for index in range(users):
+        client = app.test_client()
+        client.post('/login', data={'email': f'user{index}@example.com', 'password': 'bench'})
+        clients.append(client)
+    return clients
+
+def run(user_cache_ttl, url, requests, users):
+    """
+    Send requests round-robin from logged-in clients.
+    
+    Returns:
+        dict: Throughput, latencies and SQL statements per request
+    """
+    from app import db
+    from sqlalchemy import event
+    app = make_app(user_cache_ttl)
+    clients = logged_in_clients(app, users)
+    
+    headers = [None] * users
+    if url == '/':
+        # Revalidate the homepage so the response is a bare 304
+        headers = [{'If-None-Match': clients[index].get('/').headers['ETag']}
+                   for index in range(users)]
+    
+    statements = []
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', lambda *args: statements.append(1))
+    
+    times = []
+    start = time.perf_counter()
+    for index in range(requests):
+        request_start = time.perf_counter()
+        response = clients[index % users].get(url, headers=headers[index % users])
+        times.append((time.perf_counter() - request_start) * 1000)
+        assert response.status_code in (200, 304), response.status_code
+    elapsed = time.perf_counter() - start
+    
+    times.sort()
+    return {
+        'cache': f'ttl={user_cache_ttl}s' if user_cache_ttl else 'off',
+        'url': url,
+        'requests_per_second': requests / elapsed,
+        'p50_ms': statistics.median(times),
+        'p95_ms': times[int(len(times) * 0.95) - 1],
+        'queries_per_request': len(statements) / requests
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--users', type=int, default=50, help='logged-in clients')
+    parser.add_argument('--ttl', type=float, default=60, help='user cache TTL of the cached run')
+    args = parser.parse_args()
+    
+    columns = ('cache', 'url', 'requests_per_second', 'p50_ms', 'p95_ms', 'queries_per_request')
+    print(' '.join(f'{column:>20}' for column in columns))
+    for url in ('/', '/report/lost'):
+        for ttl in (0, args.ttl):
+            result = run(ttl, url, args.requests, args.users)
+            print(' '.join(f'{result[column]:>20.2f}' if isinstance(result[column], float)
+                           else f'{result[column]:>20}' for column in columns))
+
+if __name__ == '__main__':
+    main()
@@ -5,16 +5,124 @@ class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-secret-key-change-in-production'
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///lost_found.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # PRAGMA statements run on every new SQLite connection
+    SQLITE_PRAGMAS = {}
+    # Database for read-only views, e.g. a replica; None uses the main database
+    SQLALCHEMY_READ_DATABASE_URI = None
+    # Give read-only views their own read-only connections to the main SQLite file
+    SQLITE_READ_ONLY_CONNECTIONS = False
+    
+    # Logged-in users are cached for this many seconds instead of being
+    # loaded on every request; 0 disables the cache
+    USER_CACHE_TTL = 60
+    USER_CACHE_SIZE = 1024  # users
+    # Werkzeug password hash method and parameters, e.g. 'scrypt:32768:8:1' or
+    # 'pbkdf2:sha256:600000'; older hashes are upgraded when their user logs in
+    PASSWORD_HASH_METHOD = 'scrypt:32768:8:1'
+    # Hashes computed at once (None: half the CPUs, 0: inline in the request),
+    # logins allowed to wait for one, and seconds to wait before answering 503
+    PASSWORD_HASH_WORKERS = None
+    PASSWORD_HASH_QUEUE_SIZE = 32
+    PASSWORD_HASH_TIMEOUT = 5
     
     # Upload configuration
     UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app', 'static', 'uploads')
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+    UPLOAD_CHUNK_SIZE = 64 * 1024  # bytes copied per read while storing an upload
+    # Resized WebP copies of uploaded images, longest side in pixels (needs Pillow)
+    UPLOAD_VARIANTS = {'thumb': 320, 'display': 1280}
+    UPLOAD_VARIANT_QUALITY = 80
+    UPLOAD_VARIANT_WORKERS = 1  # background threads; 0 resizes during the upload request
+    UPLOAD_CACHE_MAX_AGE = 365 * 24 * 3600  # seconds; stored images never change
     
     # Default map center (Vellore Institute of Technology, Vellore)
     DEFAULT_LATITUDE = 12.9692
     DEFAULT_LONGITUDE = 79.1559
     
+    # Homepage map data API
+    MAP_CLUSTER_MAX_ZOOM = 15  # items are clustered below this zoom level
+    MAP_CLUSTER_CELL_SIZE = 64  # cluster grid size in pixels
+    MAP_PAGE_SIZE = 500  # maximum items per page
+    
+    # Rows per page of the matches and admin listings
+    MATCHES_PAGE_SIZE = 50
+    ADMIN_PAGE_SIZE = 50
+    
     # Matching thresholds
     MATCH_CONFIDENCE_THRESHOLD = 0.6
     LOCATION_PROXIMITY_THRESHOLD = 5000  # meters
+    # Only items inside this radius are fetched as match candidates.
+    # None uses LOCATION_PROXIMITY_THRESHOLD, 0 disables spatial pruning.
+    MATCH_SEARCH_RADIUS = None  # meters
+    # Only items reported this close in time are fetched as match candidates.
+    # None derives the widest window in which a pair can still reach
+    # MATCH_CONFIDENCE_THRESHOLD (no limit while text and location weigh
+    # more than the threshold), 0 disables time pruning.
+    MATCH_TIME_WINDOW = None  # days
+    # Number of item term vectors kept in memory for text scoring
+    TERM_VECTOR_CACHE_SIZE = 10000
+    # Default and largest k of GET /api/items/<id>/matches?k=
+    MATCH_TOP_K = 10
+    MATCH_TOP_K_MAX = 50
+    
+    # Background matching: reports return before matching finishes.
+    # Set MATCHING_ASYNC to False to match inside the request instead.
+    MATCHING_ASYNC = True
+    MATCHING_WORKERS = 2
+    # Seconds after which a job still marked running is taken to be abandoned
+    # by a stopped process and requeued; keep it well above a job's duration
+    MATCHING_JOB_LEASE = 300
+    # Request threads of each server process, e.g. gunicorn --threads
+    SERVER_THREADS = 8
+    # Server-sent match events at /api/matches/stream. Each open stream holds
+    # a server thread, so they are capped per process; more get a 503.
+    # None allows a quarter of SERVER_THREADS, leaving the rest for pages.
+    MATCH_EVENTS_MAX_STREAMS = None
+    MATCH_EVENTS_KEEPALIVE = 15  # seconds between keep-alive comments
+    MATCH_EVENTS_STREAM_LIFETIME = 300  # seconds before the browser reconnects
+    MATCH_EVENTS_HISTORY = 1000  # recent events replayed to reconnecting browsers
+    MATCH_EVENTS_QUEUE_SIZE = 100  # events buffered per stream
+    # Most items accepted by one POST /api/items request
+    INGEST_MAX_BATCH = 500
+    # Rows per batched insert of flask import-items, and per fetch of export-items
+    IMPORT_BATCH_SIZE = 5000
+    EXPORT_BATCH_SIZE = 1000
+    
+    # Full recompute (admin action / flask recompute-matches)
+    MATCHING_RECOMPUTE_WORKERS = None  # processes; None uses the CPU count
+    MATCHING_RECOMPUTE_CHUNK_SIZE = 500  # lost items per chunk
+    MATCHING_RECOMPUTE_COMMIT_SIZE = 5000  # matches written per commit
+    
+    # Request instrumentation: Server-Timing headers and Prometheus metrics at METRICS_PATH
+    INSTRUMENTATION_ENABLED = False
+    METRICS_PATH = '/metrics'
+    # Profile a share of requests and keep the profiles of those slower than
+    # PROFILE_SLOW_REQUEST_MS in PROFILE_DIR; None disables profiling
+    PROFILE_SLOW_REQUEST_MS = None
+    PROFILE_SAMPLE_RATE = 0.01
+    PROFILE_DIR = 'profiles'
+
+class ProductionConfig(Config):
+    """Settings for serving concurrent traffic from a SQLite database"""
+    # WAL lets readers run while a writer commits; NORMAL sync is safe in WAL mode
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,  # ms to wait for a lock before failing
+        'cache_size': -64000,  # 64MB page cache per connection
+        'mmap_size': 268435456,  # 256MB memory-mapped I/O
+        'temp_store': 'MEMORY'
+    }
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': 10,
+        'max_overflow': 10,
+        'pool_timeout': 10  # seconds to wait for a free connection
+    }
+    SQLITE_READ_ONLY_CONNECTIONS = True
+
+# Configurations selectable with the APP_CONFIG environment variable
+config = {
+    'default': Config,
+    'production': ProductionConfig
+}
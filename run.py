@@ -2,9 +2,10 @@
 Main entry point for the Lost & Found Flask application.
 """
 from app import create_app
-from config import Config
+from config import config
+import os
 
-app = create_app(Config)
+app = create_app(config[os.environ.get('APP_CONFIG', 'default')])
 
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,24 @@
+import pytest
+from app import create_app, db
+from config import Config
+
+class TestConfig(Config):
+    TESTING = True
+    MATCHING_ASYNC = False
+    PASSWORD_HASH_METHOD = 'pbkdf2:sha256:1000'
+
+@pytest.fixture
+def app(tmp_path):
+    """App with a fresh SQLite database and upload folder"""
+    config = type('Config', (TestConfig,), {
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "test.db"}',
+        'UPLOAD_FOLDER': str(tmp_path / 'uploads')
+    })
+    app = create_app(config)
+    with app.app_context():
+        yield app
+        db.session.remove()
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
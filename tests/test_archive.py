@@ -0,0 +1,55 @@
+from datetime import datetime
+from app import db
+from app.models import Item, Match, User
+
+def _add_items(user, *statuses):
+    items = [Item(title='black wallet', status=status, latitude=12.97, longitude=79.16,
+                  reported_at=datetime.utcnow(), reported_by=user.id) for status in statuses]
+    db.session.add_all(items)
+    db.session.commit()
+    return items
+
+def _add_match(lost, found, score=0.8):
+    match = Match(lost_item_id=lost.id, found_item_id=found.id, confidence_score=score)
+    db.session.add(match)
+    db.session.commit()
+    return match
+
+def _pairs():
+    return {(match.lost_item_id, match.found_item_id) for match in Match.query}
+
+def test_verifying_a_match_removes_other_suggestions_of_both_items(app, client):
+    admin = User(email='admin@example.com', is_admin=True)
+    admin.set_password('secret')
+    db.session.add(admin)
+    db.session.commit()
+    lost, other_lost, found, other_found = _add_items(admin, 'lost', 'lost', 'found', 'found')
+    verified = _add_match(lost, found)
+    _add_match(lost, other_found)
+    _add_match(other_lost, found)
+    _add_match(other_lost, other_found)
+    
+    client.post('/login', data={'email': 'admin@example.com', 'password': 'secret'})
+    client.get(f'/admin/verify/match/{verified.id}')
+    
+    db.session.expire_all()
+    assert _pairs() == {(lost.id, found.id), (other_lost.id, other_found.id)}
+    assert db.session.get(Match, verified.id).is_verified
+    assert lost.archived_at is not None and found.archived_at is not None
+    assert other_lost.archived_at is None and other_found.archived_at is None
+
+def test_archive_items_command_keeps_verified_matches(app):
+    user = User(email='user@example.com')
+    user.set_password('secret')
+    db.session.add(user)
+    db.session.commit()
+    lost, found, other_found = _add_items(user, 'lost', 'found', 'found')
+    verified = _add_match(lost, found)
+    verified.is_verified = True
+    _add_match(lost, other_found)
+    
+    result = app.test_cli_runner().invoke(args=['archive-items'])
+    
+    assert 'Archived 2 item(s).' in result.output
+    db.session.expire_all()
+    assert _pairs() == {(lost.id, found.id)}
@@ -0,0 +1,68 @@
+import math
+import numpy as np
+import pytest
+from app.bati.utils import (calculate_chord_distance, calculate_haversine_distance,
+                            calculate_unit_vector)
+from app.bati.scoring import EARTH_RADIUS, chord_distances
+from config import Config
+
+PROXIMITY = Config.LOCATION_PROXIMITY_THRESHOLD
+
+# Room for floating point rounding on top of the truncation bound, in meters
+ROUNDING = 1e-6
+
+def _destination(lat, lon, bearing, distance):
+    """Point reached from (lat, lon) after distance meters along a bearing, in degrees"""
+    phi, lambda_, theta = math.radians(lat), math.radians(lon), math.radians(bearing)
+    delta = distance / EARTH_RADIUS
+    phi2 = math.asin(math.sin(phi) * math.cos(delta) +
+                     math.cos(phi) * math.sin(delta) * math.cos(theta))
+    lambda2 = lambda_ + math.atan2(math.sin(theta) * math.sin(delta) * math.cos(phi),
+                                   math.cos(delta) - math.sin(phi) * math.sin(phi2))
+    # Wrap to [-180, 180) so pairs near the antimeridian straddle it
+    return math.degrees(phi2), (math.degrees(lambda2) + 180) % 360 - 180
+
+def _nearby_points(lat, lon):
+    """Points around (lat, lon) at distances up to PROXIMITY in every direction"""
+    return [_destination(lat, lon, bearing, distance)
+            for bearing in range(0, 360, 15)
+            for distance in (0.5, 10, 250, 1000, PROXIMITY / 2, PROXIMITY * 0.999)]
+
+CENTERS = [
+    (0.0, 0.0),
+    (12.9692, 79.1559),
+    (45.0, -122.0),
+    (-60.0, 30.0),
+    (89.99, 10.0),
+    (-89.995, -45.0),
+    (0.0, 179.99),
+    (-33.0, -179.995),
+    (70.0, 180.0),
+]
+
+@pytest.mark.parametrize('lat, lon', CENTERS)
+def test_chord_distance_is_within_its_bound_of_haversine(lat, lon):
+    center = calculate_unit_vector(lat, lon)
+    for other_lat, other_lon in _nearby_points(lat, lon):
+        exact = calculate_haversine_distance(lat, lon, other_lat, other_lon)
+        assert exact < PROXIMITY
+        chord = calculate_chord_distance(center, calculate_unit_vector(other_lat, other_lon))
+        # The chord never exceeds the arc, and falls short by at most d**3 / (24 R**2)
+        assert -ROUNDING <= exact - chord <= exact ** 3 / (24 * EARTH_RADIUS ** 2) + ROUNDING
+
+@pytest.mark.parametrize('lat, lon', CENTERS)
+def test_vectorized_chord_distances_match_haversine(lat, lon):
+    points = _nearby_points(lat, lon)
+    positions = np.array([calculate_unit_vector(*point) for point in points])
+    exact = np.array([calculate_haversine_distance(lat, lon, *point) for point in points])
+    chords = chord_distances(np.array(calculate_unit_vector(lat, lon)), positions)
+    bounds = exact ** 3 / (24 * EARTH_RADIUS ** 2) + ROUNDING
+    assert (np.abs(exact - chords) <= bounds).all()
+
+def test_chord_distance_crosses_the_antimeridian():
+    west = calculate_unit_vector(10.0, 179.99)
+    east = calculate_unit_vector(10.0, -179.99)
+    exact = calculate_haversine_distance(10.0, 179.99, 10.0, -179.99)
+    assert exact < 2500
+    chord = calculate_chord_distance(west, east)
+    assert 0 <= exact - chord <= exact ** 3 / (24 * EARTH_RADIUS ** 2) + ROUNDING